@@ -0,0 +1,89 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.security.Permission;
+import java.util.jar.JarFile;
+
+/**
+ * Keeps a JVM with jSymbolic2 loaded, so that features are extracted without starting a new JVM each time (cf
+ * jSymbolic.FeatureWorker, which compiles and starts it). One request per line on stdin, one answer per line on stdout :
+ * PING gives PONG, and EXTRACT midi values descriptions (separated by tabs) runs jSymbolic2 and gives OK or ERROR.
+ * System.exit, that jSymbolic2 may call once done, is blocked, otherwise the JVM would stop after one extraction. This
+ * needs a security manager, which recent versions of java do not allow : PING then gives "PONG unguarded".
+ * Usage : java -Djava.security.manager=allow -cp jSymbolic2.jar:folder_of_this_class JSymbolicServer jSymbolic2.jar
+ */
+public class JSymbolicServer {
+    /** Thrown instead of exiting when jSymbolic2 calls System.exit */
+    static class ExitBlocked extends SecurityException {
+        final int status;
+
+        ExitBlocked(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    static boolean blockExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitBlocked(status);
+                }
+
+                @Override
+                public void checkPermission(Permission permission) {
+                }
+
+                @Override
+                public void checkPermission(Permission permission, Object context) {
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        // main class of jSymbolic2, the one run by java -jar
+        String mainClass = new JarFile(args[0]).getManifest().getMainAttributes().getValue("Main-Class");
+        Method jSymbolic = Class.forName(mainClass).getMethod("main", String[].class);
+
+        PrintStream out = System.out;
+        System.setOut(System.err);  // what jSymbolic2 prints must not be mixed with the answers
+        boolean guarded = blockExit();
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] request = line.split("\t");
+            if (request[0].equals("PING")) {
+                out.println(guarded ? "PONG" : "PONG unguarded");
+            } else if (request[0].equals("EXTRACT") && request.length == 4) {
+                try {
+                    jSymbolic.invoke(null, (Object) new String[]{request[1], request[2], request[3]});
+                    out.println("OK");
+                } catch (InvocationTargetException e) {
+                    Throwable cause = e.getCause();
+                    if (cause instanceof ExitBlocked && ((ExitBlocked) cause).status == 0) {
+                        out.println("OK");
+                    } else {
+                        out.println("ERROR " + String.valueOf(cause).replace('\n', ' '));
+                    }
+                } catch (Throwable e) {
+                    out.println("ERROR " + e.toString().replace('\n', ' '));
+                }
+            } else {
+                out.println("ERROR unknown request " + request[0]);
+            }
+            out.flush();
+        }
+        // the threads jSymbolic2 may have left must not keep the JVM running
+        if (guarded) {
+            System.setSecurityManager(null);
+        }
+        System.exit(0);
+    }
+}
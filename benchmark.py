@@ -0,0 +1,498 @@
+"""
+Micro-benchmarks for the hot parts of the evaluation. Each benchmark first checks that the fast implementation gives
+the same result as the reference (per-timestep) one, then times both of them. The check functions also check the
+compiled evaluation (graphCompiler) against the graphs of MusicGraph, and the binary schemas against the text ones.
+Run it with : python benchmark.py
+"""
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import mido
+import numpy as np
+
+import generateXYZ
+import graphCompiler
+import mgGP
+import musicGeneration
+from musicGraph import MusicGraph, midiMap, output, nb_out
+
+
+def reference_delta(x, y):
+    threshold = 0.1
+    if np.abs(x-y) < threshold:
+        return 1
+    else:
+        return 0
+
+
+def reference_edge(x):
+    if x < 0 or x > 10:
+        return 0
+    else:
+        return np.power(1 - x / 10, 5)
+
+
+def reference_protected_divide(x, y):
+    if np.abs(y).all() < 0.00001:
+        return x
+    else:
+        return np.array(x)/np.array(y)
+
+
+def reference_protected_mod(x, y):
+    if np.abs(y).all() < 0.00001:
+        return x
+    else:
+        return np.array(x)%np.array(y)
+
+
+# Node functions as they were written before being vectorized, one Python iteration per timestep.
+reference_functions = {"SUM": lambda x, y: np.array(x) + np.array(y),
+                       "DELTA": lambda x, y: np.array([reference_delta(x[k], y[k]) for k in range(len(x))]),
+                       "EDGE": lambda x, y: np.array([reference_edge(x[k]) for k in range(len(x))]),
+                       "MULT": lambda x, y: np.array(x)*np.array(y),
+                       "DIV": lambda x, y: reference_protected_divide(x, y),
+                       "MOD": lambda x, y: reference_protected_mod(x,y),
+                       "SIN": lambda x, y: np.sin(([(x[k]+y[k])/2 for k in range(len(x))])),
+                       "COS": lambda x, y: np.cos(([(x[k]+y[k])/2 for k in range(len(x))])),
+                       "UNARY_MIN": lambda x: -np.array(x),
+                       "UNARY_PLUS": lambda x: np.array(x) + 1,
+                       "LOG": lambda x, y: np.array(np.log(0.00001 + np.abs([(x[k]+y[k])/2 for k in range(len(x))]))),
+                       "EXP": lambda x, y: np.array(np.exp(np.abs([(x[k]+y[k])/2 for k in range(len(x))])))}
+
+
+def reference_output(args):
+    # output as it was written before being vectorized
+    note, velocity = [], []
+    activity = 0
+    for k in range(len(args[0])):
+        activityIn = abs(args[0][k])
+        activity *= 0.25
+        activity += activityIn
+        threshold = 1.5
+        value = args[1][k]
+
+        if float(activity) < 0.05 * threshold:
+            velocity.append(0)
+            try:note.append(note[-1])
+            except:note.append(0)
+        elif float(activity) < threshold:
+            velocity.append(-1)
+            try:note.append(note[-1])
+            except:note.append(0)
+        else:
+            try:
+                vel = int(50.0 + 50.0 * np.log(1.0 + activity - threshold))
+            except:
+                vel = 0
+            activity *= 0.05
+            if vel > 127:
+                velocity.append(127)
+            else:
+                velocity.append(vel)
+
+            try:  # catch fatal error, when value is NaN or infinity
+                note.append(int(midiMap(int(18 + 32 * 0.5 * (1.0 + np.tanh(value))))))
+            except:
+                value = 100
+                note.append(int(midiMap(int(18 + 32 * 0.5 * (1.0 + np.tanh(value))))))
+    return note, velocity
+
+
+def reference_note_events(notes, velocities, quantum):
+    # state machine of runFromData, one step at a time : 0 means a note is playing, 1 means no note is playing
+    messages = []
+    cur_note, cur_vel, cur_dur, abs_time, state = notes[0], velocities[0], 0, 0, 1
+    for j in range(len(notes)):
+        input_note, input_vel = notes[j], velocities[j]
+        if state == 0:
+            if input_vel < 0:
+                cur_dur += quantum
+            elif input_vel == 0 or (input_note > 0 and input_vel > 0):
+                messages += [(True, cur_note, cur_vel, abs_time), (False, cur_note, cur_vel, abs_time + cur_dur)]
+                cur_dur = quantum
+                if input_vel == 0:
+                    state = 1
+                else:
+                    cur_note, cur_vel = input_note, input_vel
+        elif input_vel <= 0:
+            cur_dur += quantum
+        elif input_note > 0:
+            cur_note, cur_vel = input_note, input_vel
+            abs_time += cur_dur
+            cur_dur = quantum
+            state = 0
+        abs_time += quantum
+    messages.sort(key=lambda m: m[3])
+    times = [m[3] for m in messages]
+    return [(on, note, vel, time - last) for (on, note, vel, _), time, last in zip(messages, times, [0] + times)]
+
+
+def random_steps(length, rng):
+    # Notes and velocities of an output, with every kind of step (start, stop, hold, note <= 0)
+    return rng.choice([-3, 0, 40, 60, 61], size=length), rng.choice([-1, 0, 0, 50, 90], size=length)
+
+
+def random_arguments(length, seed=0):
+    """
+    Arguments used by the benchmarks : schema-like values (small positive floats), plus some zeros, negative values and
+    values out of the range of EDGE, so that every branch of the functions is used.
+    """
+    rng = np.random.RandomState(seed)
+    x = rng.uniform(-2, 12, length)
+    y = rng.uniform(-2, 12, length)
+    x[::7] = 0
+    y[::11] = y[::11] + 0.05 - (y[::11] - x[::11])  # close values, for DELTA
+    y_zero = y.copy()
+    y_zero[length // 2] = 0  # protected functions
+    return [(list(x), list(y)), (list(x), list(y_zero))]
+
+
+def check_functions(length=500):
+    """ Checks that the vectorized functions give the same values as the reference ones. """
+    with np.errstate(all='ignore'):
+        for name, function in MusicGraph.dict_functions.items():
+            reference = reference_functions[name]
+            unary = name.find("UNARY") != -1
+            for x, y in random_arguments(length):
+                args = (x,) if unary else (x, y)
+                expected, got = np.asarray(reference(*args), dtype=float), np.asarray(function(*args), dtype=float)
+                if not np.array_equal(expected, got, equal_nan=True):
+                    raise AssertionError("%s differs from its reference implementation" % name)
+
+
+def check_output(length=500, rows=20):
+    """ Checks that output gives exactly the same notes and velocities as the reference, including NaN and inf. """
+    rng = np.random.RandomState(1)
+    activity, value = rng.standard_normal((rows, length)) * 2, rng.standard_normal((rows, length)) * 10
+    activity[rng.rand(rows, length) < 0.02] = np.nan
+    activity[rng.rand(rows, length) < 0.01] = np.inf
+    value[rng.rand(rows, length) < 0.05] = np.nan
+    with np.errstate(all='ignore'):
+        note, velocity = output([activity, value])
+        for k in range(rows):
+            expected = reference_output([activity[k], value[k]])
+            if not (np.array_equal(expected[0], note[k]) and np.array_equal(expected[1], velocity[k])):
+                raise AssertionError("output differs from its reference implementation")
+
+
+def check_note_events(nb=500, quantum=260):
+    """ Checks that note_events gives exactly the messages written by the state machine of runFromData. """
+    rng = np.random.RandomState(3)
+    for k in range(nb):
+        notes, velocities = random_steps(rng.randint(1, 60), rng)
+        got = list(zip(*[a.tolist() for a in musicGeneration.note_events(notes, velocities, quantum)]))
+        if got != reference_note_events(notes.tolist(), velocities.tolist(), quantum):
+            raise AssertionError("note_events differs from its reference implementation")
+
+
+def bench_note_events(length=5000, number=3, quantum=260):
+    """ Times the extraction of the midi messages of an output. """
+    notes, velocities = random_steps(length, np.random.RandomState(4))
+    t_ref = timeit.timeit(lambda: reference_note_events(notes.tolist(), velocities.tolist(), quantum),
+                          number=number) / number
+    t_vec = timeit.timeit(lambda: musicGeneration.note_events(notes, velocities, quantum), number=number) / number
+    print("%-12s %10.1fms %10.1fms %7.1fx" % ("note_events", t_ref * 1e3, t_vec * 1e3, t_ref / t_vec))
+
+
+def random_tracks(length, rng, quantum=260):
+    # Tracks as used by runFromData : guitar, drums on channel 9 and bass
+    return [(channel, program, musicGeneration.note_events(*random_steps(length, rng), quantum))
+            for channel, program in ((0, 29), (9, 0), (2, 33))]
+
+
+def reference_midi_file(tracks):
+    # Same file, written by mido
+    mid = mido.MidiFile()
+    for channel, program, events in tracks:
+        track = mido.MidiTrack()
+        track.append(mido.Message("program_change", program=program, time=0, channel=channel))
+        for on, note, vel, time in zip(*[a.tolist() for a in events]):
+            track.append(mido.Message("note_on" if on else "note_off", note=note, velocity=vel, channel=channel,
+                                      time=time))
+        mid.tracks.append(track)
+    midi = io.BytesIO()
+    mid.save(file=midi)
+    return midi.getvalue()
+
+
+def check_midi_file(nb=200):
+    """
+    Checks that midi_file writes the same bytes as mido, and that mido reads back the messages that were written
+    (times of up to 4 bytes included).
+    """
+    rng = np.random.RandomState(5)
+    for k in range(nb):
+        tracks = random_tracks(rng.randint(1, 60), rng, quantum=rng.choice([1, 260, 100000]))
+        data = musicGeneration.midi_file(tracks)
+        if data != reference_midi_file(tracks):
+            raise AssertionError("midi_file differs from the file written by mido")
+        for (channel, program, events), track in zip(tracks, mido.MidiFile(file=io.BytesIO(data)).tracks):
+            expected = [("program_change", channel, program, 0)] + [
+                ("note_on" if on else "note_off", channel, note, time) for on, note, _, time in zip(*events)]
+            if [(m.type, m.channel, m.program if m.type == "program_change" else m.note, m.time)
+                    for m in track if not m.is_meta] != expected:
+                raise AssertionError("mido does not read back the messages written by midi_file")
+
+
+def bench_midi_file(length=5000, number=3):
+    """ Times the writing of a midi file, by mido and by midi_file. """
+    tracks = random_tracks(length, np.random.RandomState(6))
+    t_ref = timeit.timeit(lambda: reference_midi_file(tracks), number=number) / number
+    t_vec = timeit.timeit(lambda: musicGeneration.midi_file(tracks), number=number) / number
+    print("%-12s %10.1fms %10.1fms %7.1fx" % ("midi_file", t_ref * 1e3, t_vec * 1e3, t_ref / t_vec))
+
+
+def bench_output(length=5000, rows=300, number=3):
+    """ Times output, on a single output and on the outputs of a whole population at once. """
+    rng = np.random.RandomState(2)
+    activity, value = rng.uniform(0, 3, (rows, length)), rng.standard_normal((rows, length))
+    t_ref = timeit.timeit(lambda: reference_output([activity[0], value[0]]), number=number) / number
+    t_vec = timeit.timeit(lambda: output([activity[0], value[0]]), number=number) / number
+    print("%-12s %10.1fms %10.1fms %7.1fx" % ("output", t_ref * 1e3, t_vec * 1e3, t_ref / t_vec))
+    t_ref = timeit.timeit(lambda: [reference_output([a, v]) for a, v in zip(activity, value)], number=1)
+    t_vec = timeit.timeit(lambda: output([activity, value]), number=1)
+    print("%-12s %10.1fms %10.1fms %7.1fx" % ("output x%s" % rows, t_ref * 1e3, t_vec * 1e3, t_ref / t_vec))
+
+
+def random_genes(nb_node, rng):
+    # Random array with nb_node internal nodes, cf ReadMe
+    genes = []
+    for k in range(nb_node + nb_out):
+        genes += [rng.randint(0, 12), rng.randint(0, nb_node), rng.randint(0, nb_node)]
+    return genes
+
+
+def check_dtype(nb_individuals=200, nb_node=20, tolerance=0.99):
+    """
+    Checks that running the graphs in float32 (graphCompiler.eval_dtype) gives the same notes and velocities as running
+    them in float64, for at least a fraction tolerance of the steps. They can not all be the same, since the rounding
+    differs, and some functions (e.g. EXP) overflow sooner in float32.
+    """
+    rng = np.random.RandomState(3)
+    programs = [graphCompiler.compile_genes(random_genes(nb_node, rng)) for _ in range(nb_individuals)]
+    schema = musicGeneration.get_data()
+    with np.errstate(all='ignore'):
+        expected = graphCompiler.run_population(programs, schema, dtype=graphCompiler.reference_dtype)
+        got = graphCompiler.run_population(programs, schema, dtype=np.float32)
+    same = sum((e == g).sum() for e, g in zip(expected, got)) / sum(e.size for e in expected)
+    print("%-12s %.2f%% of the steps, %s/%s individuals identical" % (
+        "float32", 100 * same, sum(np.array_equal(e, g) for e, g in zip(expected, got)), nb_individuals))
+    if same < tolerance:
+        raise AssertionError("float32 evaluation differs from float64 on %.2f%% of the steps" % (100 * (1 - same)))
+
+
+def random_population(nb=200, seed=3):
+    # Arrays as found during an evolution : random ones (cf mgGP.random_genes), and children of them, mutated a lot
+    random.seed(seed)
+    arrays = mgGP.create_population(30)
+    while len(arrays) < nb:
+        first, second = random.sample(arrays, 2)
+        arrays.append(mgGP.mutate(mgGP.crossover(first, second), 0.2))
+    return arrays
+
+
+def check_schemas():
+    # Schemas used by the checks : a piece, and the same piece shifted so that it contains zeros (for DIV and MOD)
+    schema = [np.array(column, dtype=float) for column in generateXYZ.get_schema("AABA:3:4")]
+    return [schema, [column - 1 for column in schema]]
+
+
+def reference_results(genes, schema):
+    # Notes and velocities of the outputs of an array, given by the graph built by MusicGraph.array_to_graph
+    bar, beat, x, y, z = schema
+    graph = MusicGraph(inputs={"X": x, "Y": y, "Z": z, "beat": beat, "bar": bar}, internal_nodes_n=0, connect=False)
+    graph.array_to_graph(genes)
+    return np.array([graph.node[out]["values"] for out in graph._outputs])
+
+
+def check_compile_genes(nb=200):
+    """ Checks that the programs given by graphCompiler.compile_genes compute the same outputs as MusicGraph. """
+    schema = check_schemas()[0]
+    with np.errstate(all='ignore'):
+        for genes in random_population(nb):
+            expected = reference_results(genes, schema)
+            got = graphCompiler.run_program(graphCompiler.compile_genes(genes), schema,
+                                            dtype=graphCompiler.reference_dtype)
+            if not np.array_equal(expected, got):
+                raise AssertionError("compile_genes differs from MusicGraph.array_to_graph for %s" % genes)
+
+
+def check_simplify(nb=200):
+    """
+    Checks that simplify_program and canonical_genes do not change the outputs (in float64 and in float32), that they
+    give the same result when applied twice, and that canonical_genes keeps the size of the arrays.
+    """
+    with np.errstate(all='ignore'):
+        for schema in check_schemas():
+            for genes in random_population(nb):
+                program = graphCompiler.compile_genes(genes)
+                simplified = graphCompiler.simplify_program(program)
+                canonical = graphCompiler.canonical_genes(genes)
+                for dtype in (np.float64, np.float32):
+                    expected = graphCompiler.run_program(program, schema, dtype=dtype)
+                    if not np.array_equal(expected, graphCompiler.run_program(simplified, schema, dtype=dtype)):
+                        raise AssertionError("simplify_program changes the outputs of %s" % genes)
+                    if not np.array_equal(expected, graphCompiler.run_program(graphCompiler.compile_genes(canonical),
+                                                                              schema, dtype=dtype)):
+                        raise AssertionError("canonical_genes changes the outputs of %s" % genes)
+                again = graphCompiler.simplify_program(simplified)
+                if not (np.array_equal(again.parents, simplified.parents) and
+                        np.array_equal(again.outputs, simplified.outputs)):
+                    raise AssertionError("simplify_program is not idempotent on %s" % genes)
+                if graphCompiler.node_counts(simplified)[0] > graphCompiler.node_counts(program)[0]:
+                    raise AssertionError("simplify_program adds active nodes to %s" % genes)
+                if graphCompiler.canonical_genes(canonical) != canonical or len(canonical) != len(genes):
+                    raise AssertionError("canonical_genes is not a normal form of %s" % genes)
+
+
+def check_genome_hash(nb=1000):
+    """
+    Checks that the hash of an array does not change when it is put in its normal form (cf canonical_genes), or when
+    the parents of its symmetric nodes are swapped. SUM(X, Y) and SUM(Y, X) must have the same normal form too.
+    """
+    symmetric = [graphCompiler.node_types.index(name) for name in graphCompiler.symmetric]
+    for f in symmetric:
+        first = [f, "X", "Y", f, 0, "Z"] + [0, 1, 1] * nb_out
+        second = [f, "Y", "X", f, "Z", 0] + [0, 1, 1] * nb_out
+        if graphCompiler.canonical_genes(first) != graphCompiler.canonical_genes(second):
+            name = graphCompiler.node_types[f]
+            raise AssertionError("%s(X, Y) and %s(Y, X) have different normal forms" % (name, name))
+    for genes in random_population(nb):
+        h = graphCompiler.genome_hash(genes)
+        if graphCompiler.genome_hash(graphCompiler.canonical_genes(genes)) != h:
+            raise AssertionError("canonical_genes changes the hash of %s" % genes)
+        swapped = list(genes)
+        for k in range(0, len(genes) - nb_out * graphCompiler.genes_per_node, graphCompiler.genes_per_node):
+            if swapped[k] in symmetric:
+                swapped[k + 1], swapped[k + 2] = swapped[k + 2], swapped[k + 1]
+        if graphCompiler.genome_hash(swapped) != h:
+            raise AssertionError("swapping the parents of symmetric nodes changes the hash of %s" % genes)
+
+
+def check_population(generations=5):
+    """
+    Checks that run_population gives the same outputs as run_program, alone, with a subgraph table and with the
+    references of the parents (cf reusable_nodes), over a few generations.
+    """
+    schema = check_schemas()[1]
+    dtype = graphCompiler.reference_dtype
+    population = random_population(100)
+    table = graphCompiler.SubgraphTable(max_bytes=200000)  # small, so that entries are evicted
+    references = {}
+    with np.errstate(all='ignore'):
+        for generation in range(generations):
+            if generation > 0:
+                population, first_parents = mgGP.evolve(population, [random.random() for _ in population],
+                                                        generations=1, with_parents=True)
+            else:
+                first_parents = population
+            programs = [graphCompiler.compile_genes(genes) for genes in population]
+            expected = [graphCompiler.run_program(program, schema, dtype=dtype) for program in programs]
+            got = graphCompiler.run_population(programs, schema, dtype=dtype)
+            got_table, values = graphCompiler.run_population(
+                programs, schema, references=[references.get(id(genes)) for genes in first_parents],
+                keep_values=True, dtype=dtype, table=table)
+            for e, g, t in zip(expected, got, got_table):
+                if not (np.array_equal(e, g) and np.array_equal(e, t)):
+                    raise AssertionError("run_population differs from run_program")
+            references = {id(genes): (program, v) for genes, program, v in zip(population, programs, values)}
+
+
+def check_streaming(nb=100):
+    """
+    Checks that stream_program (whatever the size of the chunks) and run_schemas give the same outputs as run_program.
+    """
+    schemas = check_schemas()
+    dtype = graphCompiler.reference_dtype
+    with np.errstate(all='ignore'):
+        for genes in random_population(nb):
+            program = graphCompiler.compile_genes(genes)
+            expected = [graphCompiler.run_program(program, schema, dtype=dtype) for schema in schemas]
+            for schema, e in zip(schemas, expected):
+                for size in (1, 7, 100, len(schema[0])):
+                    chunks = lambda: ([column[s:s + size] for column in schema]
+                                      for s in range(0, len(schema[0]), size))
+                    got = np.concatenate(list(graphCompiler.stream_program(program, chunks, dtype=dtype)), axis=-1)
+                    if not np.array_equal(e, got):
+                        raise AssertionError("stream_program differs from run_program on %s" % genes)
+            for e, got in zip(expected, graphCompiler.run_schemas(program, schemas, dtype=dtype)):
+                if not np.array_equal(e, got):
+                    raise AssertionError("run_schemas differs from run_program on %s" % genes)
+
+
+def check_xyzb(specs=("AABA:3:4", "AB:5:2")):
+    """
+    Checks that the binary schemas (cf generateXYZ) give back the values of the text ones : loaded at once, converted
+    from the txyz file, and read chunk by chunk.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        for spec in specs:
+            piece = generateXYZ.parse_spec(spec)
+            piece.filename = os.path.join(folder, os.path.basename(piece.filename))
+            piece.binary_filename = os.path.join(folder, os.path.basename(piece.binary_filename))
+            piece.write()
+            expected = musicGeneration.parse_xyz(piece.filename)
+            written = musicGeneration.load_xyz(piece.binary_filename)
+            os.remove(piece.binary_filename)  # converted again from the txyz file
+            converted = musicGeneration.load_xyz(piece.filename)
+            chunked = [np.concatenate(column) for column in zip(*musicGeneration.iter_xyz(piece.filename, 10))]
+            for columns in (written, converted, chunked, generateXYZ.get_schema(spec)):
+                if not all(np.array_equal(e, c) for e, c in zip(expected, columns)):
+                    raise AssertionError("the binary schema %s differs from the text one" % spec)
+
+
+def bench_functions(length=5000, number=20):
+    """ Times every node function, reference implementation vs vectorized one. """
+    print("%-12s %12s %12s %8s" % ("function", "reference", "vectorized", "speedup"))
+    with np.errstate(all='ignore'):
+        for name, function in MusicGraph.dict_functions.items():
+            x, y = random_arguments(length)[0]
+            args = (x,) if name.find("UNARY") != -1 else (x, y)
+            t_ref = timeit.timeit(lambda: reference_functions[name](*args), number=number) / number
+            t_vec = timeit.timeit(lambda: function(*args), number=number) / number
+            print("%-12s %10.1fus %10.1fus %7.1fx" % (name, t_ref * 1e6, t_vec * 1e6, t_ref / t_vec))
+
+
+def bench_imports(modules=("graphCompiler", "musicGeneration", "mgGP", "fitness", "jSymbolic"), budget=1.0):
+    """
+    Measures the time needed to import the modules in a new interpreter (python -X importtime), and checks that it stays
+    under budget (in seconds). Importing them must not load any model or schema, nor touch the midifiles folder.
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    total = 0
+    for line in out.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() in modules:
+            cumulative = int(fields[1]) / 1e6
+            total += cumulative
+            print("%-16s %10.1fms" % ("import " + fields[2].strip(), cumulative * 1e3))
+    print("%-16s %10.1fms (budget %.0fms)" % ("imports", total * 1e3, budget * 1e3))
+    if total > budget:
+        raise AssertionError("importing %s takes %.2fs, more than %.2fs" % (", ".join(modules), total, budget))
+
+
+if __name__ == "__main__":
+    check_functions()
+    check_output()
+    check_dtype()
+    check_note_events()
+    check_midi_file()
+    check_compile_genes()
+    check_simplify()
+    check_genome_hash()
+    check_population()
+    check_streaming()
+    check_xyzb()
+    bench_functions()
+    bench_output()
+    bench_note_events()
+    bench_midi_file()
+    bench_imports()
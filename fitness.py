@@ -1,42 +1,24 @@
 """
 This file is used by main and gives the fitness of a particular set of features.
+Importing it is fast : TensorFlow, Keras and scikit-learn are only imported, and the model and the standardization data
+only loaded, the first time fitness is called (cf get_model and get_scaler).
 """
 import os
-import time
 import xml.etree.ElementTree as ET
-import keras
-import matplotlib.pyplot as plt
-from matplotlib import offsetbox
-import matplotlib.patheffects as PathEffects
-import seaborn as sns
 import numpy as np
-import tensorflow as tf
-from keras.layers import Dense, Dropout
-from keras.models import Sequential
-from sklearn.ensemble import GradientBoostingClassifier
-from sklearn.metrics import accuracy_score, precision_score
-from sklearn.preprocessing import StandardScaler
-from sklearn.manifold import TSNE
-from sklearn.model_selection import StratifiedKFold
-from deferred import dataload_hex
-from sklearn import datasets
-from mpl_toolkits.mplot3d import Axes3D
-#from XGBoost import run_XGBoost
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-print('TensorFlow version: {0}'.format(tf.__version__))
 
 # The data has to be same that was used during the evolution of the model. It is used during the standardization phase.
-X1 = ET.parse(
-    r"jSymbolic2\features\extracted_feature_led_zep124.xml").getroot()
-X2 = ET.parse(
-    r"jSymbolic2\features\extracted_feature_random_feat.xml").getroot()
-X3 = ET.parse(
-    r"jSymbolic2\features\extracted_feature_mid_test.xml").getroot()
+training_files = [r"jSymbolic2\features\extracted_feature_led_zep124.xml",
+                  r"jSymbolic2\features\extracted_feature_random_feat.xml"]
 
 # Path to the chosen model. Don't forget to change it when you want to use a different model.
 model_path = "models/dense_xml_ledzep_random_1.000.h5"
 
+_scaler = None
+_model = None
+
 
 def parse(X, y):
     out = []
@@ -62,19 +44,34 @@ def get_data(X1, X2, X3=None, X4=None):
     return X_tot, y_tot
 
 
-# Standardization with regard to the original data is needed in order to have the same normalization
-X_tot, y_tot = get_data(X1, X2)
-scaler = StandardScaler().fit(X_tot)
+def get_scaler():
+    # Standardization with regard to the original data is needed in order to have the same normalization
+    global _scaler
+    if _scaler is None:
+        from sklearn.preprocessing import StandardScaler
+
+        X_tot, y_tot = get_data(*[ET.parse(path).getroot() for path in training_files])
+        _scaler = StandardScaler().fit(X_tot)
+    return _scaler
+
+
+def get_model():
+    # Calls the model
+    global _model
+    if _model is None:
+        import keras
+        import tensorflow as tf
 
-# Calls the model
-model = keras.models.load_model(model_path)
+        print('TensorFlow version: {0}'.format(tf.__version__))
+        _model = keras.models.load_model(model_path)
+    return _model
 
 
 def fitness(features):
     # Standardizes the input
-    X_test = scaler.transform(features)
+    X_test = get_scaler().transform(features)
 
-    hist = model.predict(X_test, verbose=0)
+    hist = get_model().predict(X_test, verbose=0)
     return [hist[k][0] for k in range(len(hist))]
 
 '''verif = [k[0]>0.5 for k in hist]
@@ -0,0 +1,92 @@
+"""
+Cache of the evaluated individuals. The individuals kept by elitism and the duplicates created by crossover are
+evaluated only once : on a hit, rendering, feature extraction and fitness are all skipped.
+"""
+import os
+from collections import OrderedDict
+
+import joblib as jl
+
+from graphCompiler import genome_hash
+
+
+class FitnessCache:
+    """
+    LRU cache keyed by graphCompiler.genome_hash. Each entry is a dictionary with the fitness (None if the individual
+    gives an empty midi file), the features extracted by jSymbolic and, optionally, the bytes of the midi file.
+
+    Params:
+        max_size: maximum number of entries, the least recently used ones are removed first
+        path: if given, the cache is loaded from this file (if it exists) and save() writes it there
+        identity: what else the fitness depends on (e.g. the schema and the model, cf make_identity), saved with the
+        entries. A file saved with another identity is not loaded, since its fitness values would be stale.
+    """
+
+    def __init__(self, max_size=10000, path=None, identity=None):
+        self.max_size = max_size
+        self.path = path
+        self.identity = identity
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.isfile(path):
+            saved = jl.load(path)
+            if isinstance(saved, dict) and saved.get("identity") == identity and "entries" in saved:
+                self._entries = saved["entries"]
+            else:
+                print("Fitness cache %s ignored : it was saved with another schema or model" % path)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def key(genes):
+        return genome_hash(genes)
+
+    @staticmethod
+    def make_identity(*sources):
+        """
+        Identity of what the fitness depends on besides the array : each source is a file (identified by its path, size
+        and modification time) or any other value (e.g. a schema spec, cf musicGeneration.load_schema).
+        """
+        return tuple((source, os.path.getsize(source), os.path.getmtime(source)) if os.path.isfile(str(source))
+                     else source for source in sources)
+
+    def get(self, key):
+        """ Gives the entry of key, or None if it is not in the cache. Hits and misses are counted. """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, fitness, features=None, midi=None):
+        """ Adds an entry (or replaces it) and returns it. """
+        entry = {"fitness": fitness, "features": features, "midi": midi}
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def save(self):
+        if self.path is not None:
+            jl.dump({"identity": self.identity, "entries": self._entries}, self.path)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def reset_stats(self):
+        """ Resets the counters, typically at the start of each generation. """
+        self.hits, self.misses = 0, 0
+
+    def stats(self):
+        return "%s hits, %s misses (%.1f%%), %s entries" % (self.hits, self.misses, 100 * self.hit_rate(), len(self))
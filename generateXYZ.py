@@ -1,10 +1,73 @@
 """
 Compile it to generate various schema. Feel free to add more of them if you want input with more variety.
+Each schema is written twice : as text (.txyz, one line "bar beat x y z" per step) and in a binary format (.xyzb) that
+can be memory-mapped (cf musicGeneration.load_xyz) : "XYZB", the size of a json header (sections, signature, section
+length, number of steps...) on 4 bytes, the header, then the 5 inputs one after the other, as little-endian float64.
 """
 #!/usr/bin/env python
 
+import functools
+import json
+import os
+import struct
 import sys
-from math import *
+
+import numpy as np
+
+xyzb_magic = b"XYZB"
+xyzb_alignment = 64  # the values start at a multiple of this, so that they are aligned once mapped
+
+
+def write_xyzb(filename, columns, **header):
+    """
+    Writes a schema in the binary format. The file is written next to filename then renamed, so that a process never
+    reads a half-written file.
+    :param columns: list of 5 lists : "bar", "beat", "x", "y" and "z"
+    :param header: added to the header, e.g. sections, signature and section_length
+    """
+    values = np.ascontiguousarray(columns, dtype="<f8")
+    write_xyzb_chunks(filename, values.shape[1], [values], **header)
+
+
+def write_xyzb_chunks(filename, length, chunks, **header):
+    """
+    Same as write_xyzb, for a schema given chunk by chunk : only one chunk is in memory at a time.
+    :param length: total number of steps of the chunks
+    :param chunks: iterable of lists of 5 lists (or arrays) : "bar", "beat", "x", "y" and "z"
+    """
+    header = dict(header, length=length, dtype="<f8", inputs=["bar", "beat", "x", "y", "z"])
+    text = json.dumps(header).encode()
+    text += b" " * (-(len(xyzb_magic) + 4 + len(text)) % xyzb_alignment)
+    offset = len(xyzb_magic) + 4 + len(text)
+    tmp = "%s.%s.tmp" % (filename, os.getpid())
+    with open(tmp, "wb") as outf:
+        outf.write(xyzb_magic + struct.pack("<I", len(text)) + text)
+        outf.truncate(offset + 5 * length * 8)
+    if length > 0:
+        # the 5 inputs are stored one after the other, each chunk is written at its place in each of them
+        values = np.memmap(tmp, dtype="<f8", mode="r+", offset=offset, shape=(5, length))
+        start = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype="<f8")
+            values[:, start:start + chunk.shape[1]] = chunk
+            start += chunk.shape[1]
+        values.flush()
+        del values
+        if start != length:
+            os.remove(tmp)
+            raise ValueError("%s steps were given for a schema of %s steps" % (start, length))
+    os.replace(tmp, filename)
+
+
+def read_xyzb_header(filename):
+    """
+    :return: header (dictionary) of a binary schema, and the offset of its values in the file
+    """
+    with open(filename, "rb") as inf:
+        if inf.read(len(xyzb_magic)) != xyzb_magic:
+            raise ValueError("%s is not a binary schema" % filename)
+        size = struct.unpack("<I", inf.read(4))[0]
+        return json.loads(inf.read(size).decode()), len(xyzb_magic) + 4 + size
 
 class Piece:
 
@@ -29,42 +92,57 @@ class Piece:
         self.filename = "schema/%s_%d_%d.txyz" % (self.sections,
                                                 self.signature,
                                                 self.section_length)
+        self.binary_filename = self.filename[:-len(".txyz")] + ".xyzb"
+
+    def to_arrays(self):
+        """
+        Builds the inputs of the piece in memory, all the steps at once.
+        :return: list of 5 arrays "bar", "beat", "x", "y" and "z", with the values written in the txyz file (6 decimals)
+        """
+        t = np.arange(self.piece_length * self.signature)
+        steps = self.section_length * self.signature  # steps per section
+        sections = np.array(list(self.sections))[t // steps]
+        if not np.isin(sections, ["A", "B"]).all():
+            raise ValueError("Unknown section in %s, only A and B are allowed" % self.sections)
+
+        # We count bars and beats from 1. it's standard in music
+        # and prevents discontinuously low values on the outputs
+        # leading to silences at the start.
+        bar = 1 + (t % steps) / self.signature
+        beat = 1 + (t % self.signature)
+        # x, y and z only depend on the section (the half-sinusoid z of the original implementation was overwritten)
+        xyz = np.where(sections[:, None] == "A", Piece.avals, Piece.bvals).T
+        return [np.char.mod("%f", column).astype(float) for column in [bar, beat, xyz[0], xyz[1], xyz[2]]]
 
     def write(self):
-        outf = open(self.filename, "w+")
         print("writing " + self.filename)
-        for t in range(self.piece_length * self.signature):
-
-            # an upward-sloping curve, from 0 to 1.0.
-            # z = (t / float(self.piece_length * self.signature)) ** 5.0
-
-            # a half-sinusoid, starting at 0.5, up to 1.0, then back, slowly.
-            z = 0.5 * (1.0 + sin(2.0 * pi * t / float(self.piece_length * self.signature)))
-
-            section = self.sections[int(t / (self.section_length * self.signature))]
-
-            # We count bars and beats from 1. it's standard in music
-            # and prevents discontinuously low values on the outputs
-            # leading to silences at the start.
-            bar = 1 + ((t % (self.section_length * self.signature))
-                       / self.signature)
-            beat = 1 + (t % self.signature)
-
-            #  (t % (section_length * signature * 2)) < (section_length * signature):
-            if section == "A":
-                x = Piece.avals[0]
-                y = Piece.avals[1]
-                z = Piece.avals[2]
-            elif section == "B":
-                x = Piece.bvals[0]
-                y = Piece.bvals[1]
-                z = Piece.bvals[2]
-            else:
-                print("Error, unknown section!")
-                sys.exit(1)
-
-            outf.write("%f %f %f %f %f\n" % (bar, beat, x, y, z))
-        outf.close()
+        columns = self.to_arrays()
+        with open(self.filename, "w+") as outf:
+            outf.write("".join("%f %f %f %f %f\n" % row for row in zip(*columns)))
+        write_xyzb(self.binary_filename, columns, sections=self.sections, signature=self.signature,
+                   section_length=self.section_length, source_mtime=os.path.getmtime(self.filename))
+
+
+def parse_spec(spec):
+    """
+    :param spec: "sections:signature:section_length", e.g. "AABA:3:4" (the file of this piece is schema/AABA_3_4.txyz)
+    :return: Piece object
+    """
+    sections, signature, section_length = spec.split(":")
+    return Piece(sections, int(signature), int(section_length))
+
+
+@functools.lru_cache(maxsize=256)
+def get_schema(spec):
+    """
+    Generates a schema from its spec (cf parse_spec), without any file. The last schemas used are kept in memory.
+    :return: tuple of 5 read-only arrays : "bar", "beat", "x", "y" and "z"
+    """
+    columns = parse_spec(spec).to_arrays()
+    for column in columns:
+        column.flags.writeable = False
+    return tuple(columns)
+
 
 pieces = [
     Piece("AABB", 6, 4),
@@ -91,5 +169,6 @@ pieces = [
     ]
 
 if __name__ == "__main__":
-    for piece in pieces:
+    # python generateXYZ.py writes the pieces above, python generateXYZ.py AABA:3:4 ABB:4:4 writes these ones
+    for piece in [parse_spec(spec) for spec in sys.argv[1:]] or pieces:
         piece.write()
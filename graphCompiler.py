@@ -0,0 +1,726 @@
+"""
+Compiles the arrays used to represent MusicGraph objects (cf ReadMe) into a flat program that can be run directly on the
+inputs, without building a networkx graph. The program gives exactly the same notes and velocities as
+MusicGraph.array_to_graph, networkx is only needed to plot a graph (build it with array_to_graph in this case).
+"""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from nodeFunctions import dict_functions, output, output_chunk, protected_divide, protected_mod, inputs, node_types, \
+    nb_out, max_arity
+
+genes_per_node = max_arity + 1
+nb_inputs = len(inputs)
+
+# Functions indexed by their id in node_types, which is the first gene of each node
+kernels = [dict_functions[name] for name in node_types]
+unary = np.array([name.find("UNARY") != -1 for name in node_types])
+# Functions whose result depends on their second parent. EDGE has two parents in the arrays (cf
+# MusicGraph.array_to_graph) but ignores the second one, so it does not change the phenotype.
+uses_second = ~unary & np.array([name != "EDGE" for name in node_types])
+# Type of the values computed by the programs. float32 halves the memory used (and read) by the evaluation, use
+# reference_dtype to check results against the original implementation, which computes everything in float64.
+eval_dtype = np.float32
+reference_dtype = np.float64
+
+# Functions whose result depends on all the values of their second parent (cf protected_divide)
+protected = {node_types.index("DIV"): protected_divide, node_types.index("MOD"): protected_mod}
+# Functions that give the same values when their parents are swapped
+symmetric = ["SUM", "MULT", "DELTA", "SIN", "COS", "LOG", "EXP"]
+
+
+class Program:
+    """
+    Register machine version of a MusicGraph. Registers 0 to nb_inputs-1 hold the inputs (in the order of
+    musicGraph.inputs), register nb_inputs + k holds the values of the internal node k. Internal nodes only depend on
+    inputs or on nodes with a lower id, so running them in increasing order is always valid.
+
+    Params:
+        functions: id (in node_types) of the function of each internal node
+        parents: registers read by each internal node, shape (nb_internal, 2). Unary nodes only use the first one.
+        outputs: registers read by each output node, shape (nb_out, 2)
+    """
+    __slots__ = ("functions", "parents", "outputs")
+
+    def __init__(self, functions, parents, outputs):
+        self.functions = functions
+        self.parents = parents
+        self.outputs = outputs
+
+    def __len__(self):
+        return len(self.functions)
+
+    @property
+    def nb_registers(self):
+        return nb_inputs + len(self.functions)
+
+
+def compile_genes(genes):
+    """
+    Turns an array into a Program. Parents are resolved exactly as in MusicGraph.array_to_graph.
+    :param genes: divided in chunks of size max_arity + 1. For detailed information concerning the array, cf ReadMe
+    :return: Program object
+    """
+    nb_nodes = int(len(genes) / genes_per_node)
+    nb_internal = nb_nodes - nb_out
+
+    functions = np.zeros(nb_internal, dtype=int)
+    parents = np.zeros((nb_internal, 2), dtype=int)
+    outputs = np.zeros((nb_out, 2), dtype=int)
+
+    for node_id in range(nb_nodes):
+        gene_id = node_id * genes_per_node
+        is_output = node_id >= nb_internal
+        if is_output:
+            arity = 2
+            eligible_node = nb_internal
+        else:
+            functions[node_id] = genes[gene_id] % len(node_types)
+            arity = 1 if unary[functions[node_id]] else 2
+            eligible_node = node_id + 1  # the node itself and every node before it
+
+        regs = []
+        for i in range(arity):
+            gene_in = genes[gene_id + i + 1]
+            if gene_in in inputs:
+                regs.append(inputs.index(gene_in))
+                continue
+            input_id = gene_in % eligible_node
+            if not is_output and input_id == node_id:
+                # a node connected to itself takes one of the inputs instead
+                regs.append(node_id % nb_inputs)
+            else:
+                regs.append(nb_inputs + input_id)
+        if arity == 1:
+            regs.append(regs[0])
+        elif not is_output and not uses_second[functions[node_id]]:
+            regs[1] = regs[0]  # EDGE ignores its second parent, it is set to the first one as for unary nodes
+
+        if is_output:
+            outputs[node_id - nb_internal] = regs
+        else:
+            parents[node_id] = regs
+
+    return Program(functions, parents, outputs)
+
+
+def active_nodes(program):
+    """
+    Finds the internal nodes that are connected to at least one output. The other ones do not change the midi file,
+    so there is no need to compute them.
+    :return: boolean array, one value per internal node
+    """
+    active = [False] * len(program)
+    for reg in program.outputs.ravel().tolist():
+        if reg >= nb_inputs:
+            active[reg - nb_inputs] = True
+    # Parents always have a lower id, so a single sweep from the last node to the first one is enough
+    functions, parents = program.functions.tolist(), program.parents.tolist()
+    for node_id in reversed(range(len(program))):
+        if not active[node_id]:
+            continue
+        in1, in2 = parents[node_id]
+        for reg in (in1, in2) if uses_second[functions[node_id]] else (in1,):
+            if reg >= nb_inputs:
+                active[reg - nb_inputs] = True
+    return np.array(active, dtype=bool)
+
+
+def node_counts(program):
+    """
+    Gives the number of active nodes (cf active_nodes) and the total number of internal nodes, the former being a cheap
+    measure of the complexity of an individual.
+    """
+    return int(active_nodes(program).sum()), len(program)
+
+
+def prune_program(program):
+    """
+    Removes the internal nodes that are not connected to any output. The remaining nodes keep their order.
+    :return: Program object
+    """
+    active = active_nodes(program)
+    if active.all():
+        return program
+    # register of each internal node in the pruned program
+    regs = np.concatenate((np.arange(nb_inputs), nb_inputs + np.cumsum(active) - 1))
+    parents = program.parents[active]
+    # the second parent of a node that does not use it may be removed, the first one is used instead
+    ignored = ~uses_second[program.functions[active]]
+    parents[ignored, 1] = parents[ignored, 0]
+    return Program(program.functions[active], regs[parents], regs[program.outputs])
+
+
+def simplify_program(program):
+    """
+    Rewrites a program so that it gives exactly the same outputs with fewer active nodes (cf active_nodes) :
+    - UNARY_MIN of UNARY_MIN is replaced by the node under them,
+    - DELTA of a node with itself is 1 everywhere if the node can not be infinite or NaN, so MULT or DIV by such a node
+      is replaced by the other parent, and all these nodes are merged,
+    - EDGE does not use its second parent, which is set to the first one,
+    - nodes with the same function and the same parents (in any order for symmetric functions) are merged.
+    The nodes keep their ids, the ones that are replaced are simply no longer connected to any output, so that
+    reusable_nodes still works between a simplified child and its simplified parent. SUM(x, x) and chains of
+    UNARY_PLUS are left as they are : there are no constants in the arrays to write 2 * x or x + 2 with (and (x + 1) + 1
+    is not always x + 2 with floats).
+    :return: Program object
+    """
+    functions = program.functions.tolist()
+    alias = list(range(program.nb_registers))  # register: register that has the same values
+    finite = [True] * nb_inputs + [False] * len(program)  # values that can not be infinite or NaN
+    ones = []  # DELTA nodes that are 1 everywhere
+    seen = {}
+    parents = []
+    for node_id, (in1, in2) in enumerate(program.parents.tolist()):
+        reg, name = nb_inputs + node_id, node_types[functions[node_id]]
+        in1, in2 = alias[in1], alias[in2]
+        if name == "EDGE":
+            in2 = in1
+        parents.append([in1, in2])
+        if name == "UNARY_MIN" and in1 >= nb_inputs and functions[in1 - nb_inputs] == functions[node_id]:
+            alias[reg] = parents[in1 - nb_inputs][0]
+        elif name in ("MULT", "DIV") and in2 in ones:
+            alias[reg] = in1
+        elif name == "MULT" and in1 in ones:
+            alias[reg] = in2
+        elif name == "DELTA" and in1 == in2 and finite[in1] and len(ones) > 0:
+            alias[reg] = ones[0]
+        else:
+            key = (functions[node_id], in1, in2)
+            if name in symmetric:
+                key = (functions[node_id],) + tuple(sorted((in1, in2)))
+            if key in seen:
+                alias[reg] = seen[key]
+                continue
+            seen[key] = reg
+            if name == "DELTA" and in1 == in2 and finite[in1]:
+                ones.append(reg)
+            finite[reg] = name == "DELTA" or (name in ("UNARY_MIN", "UNARY_PLUS", "EDGE") and finite[in1])
+
+    outputs = [[alias[reg] for reg in regs] for regs in program.outputs.tolist()]
+    return Program(program.functions.copy(), np.array(parents, dtype=int).reshape(-1, 2), np.array(outputs, dtype=int))
+
+
+def canonical_program(program):
+    """
+    Normal form of a program : only the nodes that are reachable from the outputs are kept, and they are renumbered in
+    the order of a depth-first traversal (post-order) starting from output1, then output2 and output3, first parent
+    first. Parents of symmetric functions are put in the order of their structural keys (cf subgraph_keys) first, so
+    SUM(a, b) and SUM(b, a) have the same normal form. Two programs that compute the same outputs with the same nodes
+    have the same normal form, whatever the order and the ids of their nodes. Runs in linear time.
+    :return: Program object
+    """
+    parents = program.parents.tolist()
+    keys = [name.encode() for name in inputs] + subgraph_keys(program)
+    for node_id, f in enumerate(program.functions.tolist()):
+        in1, in2 = parents[node_id]
+        if node_types[f] in symmetric and keys[in2] < keys[in1]:
+            parents[node_id] = [in2, in1]
+    new_id = {}  # old id of an internal node: new id
+    order = []  # old ids in the new order
+
+    for reg in program.outputs.ravel().tolist():
+        stack = [(reg, False)]
+        while len(stack) > 0:
+            reg, expanded = stack.pop()
+            node_id = reg - nb_inputs
+            if reg < nb_inputs or node_id in new_id:
+                continue
+            if expanded:
+                new_id[node_id] = len(order)
+                order.append(node_id)
+                continue
+            stack.append((reg, True))
+            in1, in2 = parents[node_id]
+            if uses_second[program.functions[node_id]]:
+                stack.append((in2, False))
+            stack.append((in1, False))
+
+    def rename(reg):
+        return reg if reg < nb_inputs else nb_inputs + new_id[reg - nb_inputs]
+
+    functions = program.functions[order] if len(order) > 0 else np.zeros(0, dtype=int)
+    new_parents = np.array([[rename(reg) for reg in parents[node_id]] for node_id in order], dtype=int).reshape(-1, 2)
+    new_outputs = np.array([[rename(reg) for reg in regs] for regs in program.outputs.tolist()], dtype=int)
+    return Program(functions, new_parents, new_outputs)
+
+
+def program_to_genes(program, nb_internal=None):
+    """
+    Array of a program, that compile_genes turns back into the same program. Inputs are written with their names and
+    internal nodes with their ids. The gene slots that are not used (second parent of unary nodes and of EDGE, function
+    of output nodes) are set to 0.
+    :param nb_internal: if given, nodes whose genes are all 0 are added after the nodes of the program, so that the
+    array has nb_internal internal nodes. They are not connected to any output.
+    """
+    def gene(reg):
+        return inputs[reg] if reg < nb_inputs else reg - nb_inputs
+
+    genes = []
+    for f, (in1, in2) in zip(program.functions.tolist(), program.parents.tolist()):
+        genes += [f, gene(in1), gene(in2) if uses_second[f] else 0]
+    if nb_internal is not None:
+        genes += [0] * genes_per_node * (nb_internal - len(program))
+    for in1, in2 in program.outputs.tolist():
+        genes += [0, gene(in1), gene(in2)]
+    return genes
+
+
+def canonical_genes(genes):
+    """
+    Unique normal form of an array : arrays of the same size that give the same graph (up to the ids of the nodes, and
+    ignoring the nodes that are not connected to any output) have the same normal form. Cf canonical_program. The
+    nodes that are not connected to any output are replaced by nodes whose genes are all 0, at the end of the array, so
+    that its size does not change.
+    :return: array, that can be fed to compile_genes or MusicGraph.array_to_graph
+    """
+    program = compile_genes(genes)
+    return program_to_genes(canonical_program(program), len(program))
+
+
+def genome_hash(genes):
+    """
+    Hash of the normal form of an array (cf canonical_program), so that arrays that give the same graph have the same
+    hash, even if they do not have the same size. Arrays are simplified first (cf simplify_program), so that arrays
+    that only differ by redundant nodes have the same hash too.
+    :return: hexadecimal string
+    """
+    program = canonical_program(simplify_program(compile_genes(genes)))
+    h = hashlib.sha1()
+    for a in (program.functions, program.parents, program.outputs):
+        h.update(np.ascontiguousarray(a, dtype=np.int64).tobytes())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+def cast_schema(schema, dtype=None):
+    """
+    Turns the inputs into arrays of the evaluation type once and for all, so that they are not converted again each
+    time a program is run.
+    :param schema: either a dictionary input name: vector (as for MusicGraph), or the list of 5 lists "bar", "beat",
+    "x", "y" and "z" returned by musicGeneration.parse_xyz or load_xyz
+    :param dtype: type of the values, eval_dtype by default
+    :return: dictionary input name: array
+    """
+    if not isinstance(schema, dict):
+        schema = {"bar": schema[0], "beat": schema[1], "X": schema[2], "Y": schema[3], "Z": schema[4]}
+    return {name: np.asarray(schema[name], dtype=dtype or eval_dtype) for name in inputs}
+
+
+def input_values(schema, dtype=None):
+    """
+    Gives the input registers in the order expected by a Program.
+    :param schema: inputs, cf cast_schema
+    :param dtype: type of the values, eval_dtype by default
+    :return: list of arrays
+    """
+    schema = cast_schema(schema, dtype)
+    return [schema[name] for name in inputs]
+
+
+def unique_inputs(schema, dtype=None):
+    """
+    X, Y and Z are constant within each section of the piece and bar and beat are periodic, so the same input rows come
+    back again and again. The functions of the nodes only depend on the inputs of the same step, so the nodes can be
+    computed on the distinct rows only, and their values put back on the timeline with inverse before output(), which
+    is the only step that depends on the previous ones. DIV and MOD look at the whole piece, but only to know whether
+    their second parent is ever 0, which does not change either.
+    :param schema: inputs, cf input_values
+    :param dtype: type of the values, eval_dtype by default
+    :return: list of arrays (the distinct rows, one array per input) and inverse, such that unique[i][inverse] is the
+    input i
+    """
+    inputs = np.array(input_values(schema, dtype))
+    unique, inverse = np.unique(inputs, axis=1, return_inverse=True)
+    return list(unique), inverse.ravel()
+
+
+def run_program(program, schema, dtype=None):
+    """
+    Runs a program on the inputs. The nodes that are not connected to any output are not computed, and the other ones
+    are only computed on the distinct input rows (cf unique_inputs).
+    :param program: Program object
+    :param schema: inputs, cf input_values
+    :param dtype: type of the values of the nodes, eval_dtype by default
+    :return: array of shape nb_out*2*len(schema), the note and velocity of each output, as used by
+    musicGeneration.runFromData
+    """
+    dtype = dtype or eval_dtype
+    program = prune_program(program)
+    inputs, inverse = unique_inputs(schema, dtype)
+    values = inputs + [None] * len(program)
+    for k, (f, (in1, in2)) in enumerate(zip(program.functions.tolist(), program.parents.tolist())):
+        if unary[f]:
+            values[nb_inputs + k] = kernels[f](values[in1]).astype(dtype, copy=False)
+        else:
+            values[nb_inputs + k] = kernels[f](values[in1], values[in2]).astype(dtype, copy=False)
+
+    note, velocity = output([np.array([values[in1] for in1 in program.outputs[:, 0]], dtype=float)[:, inverse],
+                             np.array([values[in2] for in2 in program.outputs[:, 1]], dtype=float)[:, inverse]])
+    return np.stack((note, velocity), axis=1)
+
+
+def node_depths(program):
+    """
+    Depth of each internal node : inputs have depth 0, and a node is one level deeper than its deepest parent. Nodes
+    of the same depth do not depend on each other and can be computed together.
+    """
+    depths = [0] * program.nb_registers
+    for k, (in1, in2) in enumerate(program.parents.tolist()):
+        depths[nb_inputs + k] = 1 + max(depths[in1], depths[in2])
+    return np.array(depths[nb_inputs:], dtype=int)
+
+
+def stream_program(program, chunks, dtype=None):
+    """
+    Runs a program on a schema given chunk by chunk, so that the memory used does not depend on the length of the
+    piece. The state of the outputs is carried from one chunk to the next, so the notes and velocities are exactly the
+    ones given by run_program.
+    DIV and MOD nodes return their first parent unchanged if their second parent is 0 anywhere in the piece, so this is
+    first found out with a pass over the whole schema. Since the second parent may itself depend on DIV and MOD nodes,
+    one pass is needed for each level of such nodes, hence chunks is a function and not a simple iterator.
+    :param program: Program object
+    :param chunks: function without argument that returns an iterator over the chunks of the schema, each one given as
+    inputs (cf input_values), e.g. lambda: musicGeneration.iter_xyz(filename, 4096)
+    :param dtype: type of the values of the nodes, eval_dtype by default
+    :return: generator of arrays of shape nb_out*2*len(chunk)
+    """
+    dtype = dtype or eval_dtype
+    program = prune_program(program)
+    functions, parents = program.functions.tolist(), program.parents.tolist()
+
+    # Pass after which the values of each register can be computed : the safe flag of a DIV or MOD node is only known
+    # once its second parent has been computed on the whole piece.
+    ready = [0] * program.nb_registers
+    for k, (in1, in2) in enumerate(parents):
+        if functions[k] in protected:
+            ready[nb_inputs + k] = max(ready[in1], ready[in2] + 1)
+        else:
+            ready[nb_inputs + k] = max(ready[in1], ready[in2])
+    last_pass = max([ready[reg] for reg in program.outputs.ravel().tolist()] + [0])
+
+    safe = {}  # node id of a DIV or MOD node: False if its second parent contains a 0
+
+    def run_chunk(chunk, current_pass):
+        values = input_values(chunk, dtype) + [None] * len(program)
+        for k, (f, (in1, in2)) in enumerate(zip(functions, parents)):
+            if ready[nb_inputs + k] > current_pass:
+                continue
+            if f in protected:
+                value = protected[f](values[in1], values[in2], safe[k])
+            elif unary[f]:
+                value = kernels[f](values[in1])
+            else:
+                value = kernels[f](values[in1], values[in2])
+            values[nb_inputs + k] = value.astype(dtype, copy=False)
+        return values
+
+    for current_pass in range(last_pass):
+        found = [k for k in range(len(program)) if functions[k] in protected and ready[parents[k][1]] == current_pass]
+        for k in found:
+            safe[k] = True
+        for chunk in chunks():
+            values = run_chunk(chunk, current_pass)
+            for k in found:
+                safe[k] = safe[k] and bool(np.all(values[parents[k][1]] != 0))
+
+    state = (0., 0)
+    for chunk in chunks():
+        values = run_chunk(chunk, last_pass)
+        note, velocity, state = output_chunk([np.array([values[in1] for in1 in program.outputs[:, 0]], dtype=float),
+                                              np.array([values[in2] for in2 in program.outputs[:, 1]], dtype=float)],
+                                             state)
+        yield np.stack((note, velocity), axis=1)
+
+
+def run_schemas(program, schemas, dtype=None):
+    """
+    Runs a program on several schemas at once, e.g. to check that a good array stays good with different inputs (cf
+    ReadMe). The schemas are padded to the length of the longest one and stacked, so that each function is called once
+    for all of them. DIV and MOD nodes only look at the steps that are not padding, and the padding is at the end, where
+    it can not change the outputs, so each schema gives exactly the results of run_program.
+    :param program: Program object
+    :param schemas: list of inputs, cf input_values
+    :param dtype: type of the values of the nodes, eval_dtype by default
+    :return: list of arrays of shape nb_out*2*len(schema), one per schema
+    """
+    dtype = dtype or eval_dtype
+    program = prune_program(program)
+    schemas = [input_values(schema, dtype) for schema in schemas]
+    lengths = np.array([len(schema[0]) for schema in schemas])
+    padded = np.zeros((nb_inputs, len(schemas), lengths.max()), dtype=dtype)
+    for k, schema in enumerate(schemas):
+        padded[:, k, :lengths[k]] = schema
+    valid = np.arange(lengths.max()) < lengths[:, None]
+
+    values = list(padded) + [None] * len(program)
+    for k, (f, (in1, in2)) in enumerate(zip(program.functions.tolist(), program.parents.tolist())):
+        if f in protected:
+            safe = np.all((values[in2] != 0) | ~valid, axis=-1, keepdims=True)
+            value = protected[f](values[in1], values[in2], safe)
+        elif unary[f]:
+            value = kernels[f](values[in1])
+        else:
+            value = kernels[f](values[in1], values[in2])
+        values[nb_inputs + k] = value.astype(dtype, copy=False)
+
+    # one row per schema and output
+    note, velocity = output([np.concatenate([values[in1] for in1 in program.outputs[:, 0]]),
+                             np.concatenate([values[in2] for in2 in program.outputs[:, 1]])])
+    results = np.stack((note, velocity), axis=1).reshape(nb_out, len(schemas), 2, -1)
+    return [results[:, k, :, :lengths[k]] for k in range(len(schemas))]
+
+
+def subgraph_keys(program, dtype=None):
+    """
+    Structural hash of the subgraph of each internal node, computed from its function and the hashes of its parents :
+    two nodes, of the same program or not, with the same key compute the same values from the same inputs. Parents of
+    symmetric functions are sorted, so SUM(a, b) and SUM(b, a) have the same key.
+    :param dtype: type of the values of the nodes, eval_dtype by default. It is part of the hash of the inputs.
+    :return: list of bytes, one per internal node
+    """
+    dtype = np.dtype(dtype or eval_dtype).name
+    keys = [hashlib.sha1(("%s|%s" % (name, dtype)).encode()).digest() for name in inputs]
+    for f, (in1, in2) in zip(program.functions.tolist(), program.parents.tolist()):
+        parents = [keys[in1]] if unary[f] else [keys[in1], keys[in2]]
+        if node_types[f] in symmetric:
+            parents.sort()
+        keys.append(hashlib.sha1(bytes([f]) + b"".join(parents)).digest())
+    return keys[nb_inputs:]
+
+
+class SubgraphTable:
+    """
+    Values of the subgraphs already computed by run_population, keyed by subgraph_keys, so that a subgraph shared by
+    several individuals (elites, genes copied by crossover) is computed only once. Nodes that are shared within a
+    population are counted too (shared), as well as nodes found in the table (hits). The values depend on the inputs,
+    so a table must only be used with one schema.
+
+    Params:
+        max_bytes: maximum size of the values stored, the least recently used ones are removed first
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nb_bytes = 0
+        self._values = OrderedDict()
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key):
+        """ Gives the values of key, or None if they are not in the table. Hits and misses are counted. """
+        value = self._values.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._values.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._values:
+            self.nb_bytes -= self._values.pop(key).nbytes
+        self._values[key] = value.copy()
+        self.nb_bytes += value.nbytes
+        while self.nb_bytes > self.max_bytes and len(self._values) > 0:
+            self.nb_bytes -= self._values.popitem(last=False)[1].nbytes
+            self.evictions += 1
+
+    def hit_rate(self):
+        """ Part of the nodes that were not computed (found in the table or shared within the population) """
+        total = self.hits + self.shared + self.misses
+        return (self.hits + self.shared) / total if total > 0 else 0.
+
+    def reset_stats(self):
+        """ Resets the counters, typically at the start of each generation. """
+        self.hits, self.shared, self.misses, self.evictions = 0, 0, 0, 0
+
+    def stats(self):
+        return "%s hits, %s shared, %s computed (%.1f%% saved), %s entries (%.1f MB), %s evicted" % (
+            self.hits, self.shared, self.misses, 100 * self.hit_rate(), len(self), self.nb_bytes / 2 ** 20,
+            self.evictions)
+
+
+def reusable_nodes(program, reference):
+    """
+    Finds the internal nodes of program whose values are already known from reference, typically a parent of program :
+    a node is reusable if the node with the same id in reference has the same function and the same parents, and if
+    these parents are inputs or reusable too. After a mutation, only the nodes downstream of the changed genes are not
+    reusable, and after a crossover the nodes before the crossover point are reusable (with the first parent as
+    reference).
+    :param reference: tuple (program, values), values as returned by run_population with keep_values=True
+    :return: boolean array, one value per internal node
+    """
+    ref_program, ref_values = reference
+    same = [False] * len(program)
+    functions, parents = program.functions.tolist(), program.parents.tolist()
+    ref_functions, ref_parents = ref_program.functions.tolist(), ref_program.parents.tolist()
+    for node_id in range(min(len(program), len(ref_program))):
+        if functions[node_id] != ref_functions[node_id] or parents[node_id] != ref_parents[node_id]:
+            continue
+        same[node_id] = all(reg < nb_inputs or same[reg - nb_inputs] for reg in parents[node_id])
+    # the reference only keeps the values of its active nodes
+    return np.array([same[k] and ref_values[k] is not None for k in range(len(program))], dtype=bool)
+
+
+def run_population(programs, schema, references=None, keep_values=False, dtype=None, table=None):
+    """
+    Runs every program of a population on the same inputs. The values of all the nodes of the population are stored in
+    a single 2-D buffer (one row per node), and the nodes are grouped by depth and function, so that each function is
+    called once per depth for the whole population instead of once per node. Nodes that are not connected to any
+    output (cf active_nodes) are not computed, neither are nodes whose values can be taken from a reference (cf
+    reusable_nodes). Nodes with the same structure (cf subgraph_keys) are computed once for the whole population, and
+    not at all if they are found in table. Nodes are only computed on the distinct input rows (cf unique_inputs).
+    :param programs: list of Program objects
+    :param schema: inputs, cf input_values. References must have been run on the same inputs.
+    :param references: None, or one reference per program, either None or a tuple (program, values)
+    :param keep_values: if True, the values of the internal nodes are returned too, so that they can be used as
+    references
+    :param dtype: type of the values of the nodes, eval_dtype by default
+    :param table: None, or a SubgraphTable used with the same inputs. The nodes computed are added to it.
+    :return: list of arrays of shape nb_out*2*len(schema), one per program, as returned by run_program. If keep_values,
+    also the list of the values of each program, one array per internal node (None for inactive nodes), given on the
+    distinct input rows.
+    """
+    if len(programs) == 0:
+        return ([], []) if keep_values else []
+    if references is None:
+        references = [None] * len(programs)
+    dtype = dtype or eval_dtype
+    inputs, inverse = unique_inputs(schema, dtype)
+    sizes = [len(program) for program in programs]
+    starts = nb_inputs + np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(int)
+    buffer = np.empty((nb_inputs + sum(sizes), len(inputs[0])), dtype=dtype)
+    buffer[:nb_inputs] = inputs
+
+    # Program registers are turned into rows of the buffer. The inputs are shared by all the programs, and so is every
+    # subgraph that appears in several programs : the registers of the copies point to the row of the first one.
+    actives, row_maps, functions, depths, dest, src, computed = [], [], [], [], [], [], []
+    first_rows = {}  # structural key: row of the buffer
+    for program, reference, start in zip(programs, references, starts):
+        active = active_nodes(program)
+        reused = np.zeros(len(program), dtype=bool)
+        if reference is not None:
+            reused = reusable_nodes(program, reference) & active
+        keys = subgraph_keys(program, dtype)
+        node_depth = node_depths(program).tolist()
+        rows = list(range(nb_inputs)) + list(range(start, start + len(program)))
+        for node_id in np.flatnonzero(active).tolist():
+            key, row = keys[node_id], start + node_id
+            if key in first_rows:
+                rows[nb_inputs + node_id] = first_rows[key]
+                if table is not None:
+                    table.shared += 1
+                continue
+            first_rows[key] = row
+            if reused[node_id]:
+                buffer[row] = reference[1][node_id]
+                continue
+            value = table.get(key) if table is not None else None
+            if value is not None:
+                buffer[row] = value
+                continue
+            in1, in2 = program.parents[node_id].tolist()
+            functions.append(program.functions[node_id])
+            depths.append(node_depth[node_id])
+            dest.append(row)
+            src.append((rows[in1], rows[in2]))
+            computed.append(key)
+        actives.append(active)
+        row_maps.append(np.array(rows))
+    functions, depths = np.array(functions, dtype=int), np.array(depths, dtype=int)
+    dest, src = np.array(dest, dtype=int), np.array(src, dtype=int).reshape(-1, 2)
+
+    order = np.lexsort((functions, depths))
+    keys = depths[order] * len(node_types) + functions[order]
+    for group in np.split(order, np.flatnonzero(np.diff(keys)) + 1):
+        if len(group) == 0:
+            continue
+        f = functions[group[0]]
+        if unary[f]:
+            buffer[dest[group]] = kernels[f](buffer[src[group, 0]])
+        else:
+            buffer[dest[group]] = kernels[f](buffer[src[group, 0]], buffer[src[group, 1]])
+    if table is not None:
+        for key, row in zip(computed, dest.tolist()):
+            table.put(key, buffer[row])
+
+    # Every output of the population is computed at once, one row per output
+    rows = np.concatenate([row_map[program.outputs] for program, row_map in zip(programs, row_maps)])
+    note, velocity = output([buffer[rows[:, 0]][:, inverse], buffer[rows[:, 1]][:, inverse]])
+    results = list(np.stack((note, velocity), axis=1).reshape(len(programs), nb_out, 2, len(inverse)))
+    if not keep_values:
+        return results
+    values = []
+    for active, row_map in zip(actives, row_maps):
+        block = buffer[row_map[nb_inputs:]]  # a copy, so that the buffer itself is not kept alive
+        values.append([block[k] if active[k] else None for k in range(len(active))])
+    return results, values
+
+
+class CompactMusicGraph:
+    """
+    Lightweight replacement of MusicGraph for the evaluation : the graph is stored as a Program (NumPy arrays of
+    function ids and parent registers) and the values of the nodes in a single contiguous array, instead of a networkx
+    graph with a dictionary of attributes per node. Use to_music_graph to get a MusicGraph, e.g. to plot it.
+
+    Params:
+        inputs: dictionary type input: vector, as for MusicGraph
+    """
+    __slots__ = ("_inputs", "program", "values", "results")
+
+    def __init__(self, inputs):
+        self._inputs = inputs
+        self.program = Program(np.zeros(0, dtype=int), np.zeros((0, 2), dtype=int), np.zeros((nb_out, 2), dtype=int))
+        # values of the internal nodes, one row per node (NaN for the nodes that are not connected to any output)
+        self.values = np.zeros((0, 0))
+        # notes and velocities of the outputs, shape nb_out*2*len(inputs), as used by musicGeneration.runFromData
+        self.results = np.zeros((nb_out, 2, 0), dtype=int)
+
+    def __len__(self):
+        return len(self.program)
+
+    def array_to_graph(self, genes):
+        """
+        Builds the graph from an array and computes its values, cf MusicGraph.array_to_graph.
+        """
+        self.program = compile_genes(genes)
+        results, values = run_population([self.program], self._inputs, keep_values=True)
+        self.results = results[0]
+        inverse = unique_inputs(self._inputs)[1]
+        self.values = np.full((len(self.program), self.results.shape[-1]), np.nan, dtype=eval_dtype)
+        for node_id, v in enumerate(values[0]):
+            if v is not None:
+                self.values[node_id] = v[inverse]
+
+    def to_array(self):
+        """ Gives the array associated with the graph, in normal form (cf canonical_genes). """
+        return program_to_genes(canonical_program(self.program), len(self.program))
+
+    def variety(self):
+        # Fitness function, basically counts the number of different notes.
+        retval = 0
+        for notes in self.results[:, 0]:
+            retval += len(np.unique(notes)) / len(notes)  # Number of different notes / Total number of notes
+        return retval / nb_out
+
+    def to_music_graph(self):
+        """ Gives the equivalent MusicGraph (networkx graph), for instance to plot it. """
+        from musicGraph import MusicGraph  # networkx is only imported when needed
+
+        graph = MusicGraph(inputs=self._inputs, internal_nodes_n=0, connect=False)
+        graph.array_to_graph(self.to_array())
+        return graph
+
+    def plot(self):
+        self.to_music_graph().plot()
@@ -1,27 +1,226 @@
+import atexit
+import queue
+import re
 import subprocess
 import os
+import tempfile
+import threading
 import xml.etree.ElementTree as ET
 
+# Midi files given as bytes are written there before jSymbolic reads them : tmpfs when available, so that they never
+# touch the disk
+scratch_root = "/dev/shm" if os.path.isdir("/dev/shm") else None
 
-def get_features(midi):
-    """function creates feature_values.xml file which contains features for subsequent parsing """
-    # after calling this function jSymbolic will create 3 useless (in our case) files
-    FNULL = open(os.devnull, 'w')
-    subprocess.call(['java', '-Xmx1048m', '-jar', 'jSymbolic2/dist/jSymbolic2.jar', midi,
-                     'feature_values.xml', 'feature_descriptions.xml'], stdout=FNULL, stderr=subprocess.STDOUT)
+jar = 'jSymbolic2/dist/jSymbolic2.jar'
+# jSymbolic runs in a JVM that is kept from one extraction to the next (cf FeatureWorker). Set persistent to False to
+# start java for each extraction instead, and worker_command to use another worker, e.g. the stub :
+# [sys.executable, "jSymbolicStub.py"]. By default, the worker is JSymbolicServer.java, compiled in server_folder.
+persistent = True
+worker_command = None
+server_source = 'JSymbolicServer.java'
+server_folder = 'jSymbolic2/server'
+_worker = None
+
+
+def java_version():
+    """ :return: major version of java (8 for 1.8), None if it can not be run """
+    try:
+        output = subprocess.run(['java', '-version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True).stdout
+    except OSError:
+        return None
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return None
+    major = int(match.group(1))
+    return int(match.group(2) or 0) if major == 1 else major
+
+
+def server_command():
+    """
+    Compiles JSymbolicServer.java if needed. From java 12 on, the server is allowed to set a security manager, which it
+    needs to block System.exit (java 8 to 11 allow it anyway, and do not know this option).
+    :return: the command that starts it, or None if it can not be compiled (no javac)
+    """
+    class_file = os.path.join(server_folder, "JSymbolicServer.class")
+    if not os.path.isfile(class_file) or os.path.getmtime(class_file) < os.path.getmtime(server_source):
+        os.makedirs(server_folder, exist_ok=True)
+        try:
+            subprocess.check_call(['javac', '-d', server_folder, server_source], stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    version = java_version()
+    options = ['-Djava.security.manager=allow'] if version is not None and version >= 12 else []
+    return ['java', '-Xmx1048m'] + options + ['-cp', os.pathsep.join([jar, server_folder]), 'JSymbolicServer', jar]
+
+
+class FeatureWorker:
+    """
+    Long-lived process that extracts features, so that the JVM start, the loading of jSymbolic and the JIT warm-up are
+    paid once instead of at each generation. Requests and answers are lines on its stdin and stdout (cf
+    JSymbolicServer.java), read by a thread so that waiting for an answer can time out on any platform. The worker is
+    started on the first request, and started again if it died or did not answer in time. A worker that exits during an
+    extraction (jSymbolic calling System.exit, when the server can not block it) is reported and counted in exits : it
+    still works, but starts a new JVM for each extraction.
+
+    Params:
+        command: command that starts the worker
+        timeout: maximum time of an extraction, in seconds
+        start_timeout: maximum time for the worker to start and answer a health check, in seconds
+    """
+
+    def __init__(self, command, timeout=600., start_timeout=120.):
+        self.command = command
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.starts = 0
+        self.exits = 0
+        self._process = None
+        self._answers = None
+
+    def start(self):
+        self.close()
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, universal_newlines=True)
+        self._answers = queue.Queue()
+        threading.Thread(target=_read_lines, args=(self._process.stdout, self._answers), daemon=True).start()
+        self.starts += 1
+        answer = self._request("PING", self.start_timeout)
+        if answer is None or not answer.startswith("PONG"):
+            self.close()
+            raise RuntimeError("the jSymbolic worker did not start : %s" % " ".join(self.command))
+        if answer == "PONG unguarded" and self.starts == 1:
+            print("Warning : the jSymbolic worker can not block System.exit, jSymbolic may stop it after each "
+                  "extraction")
+
+    def alive(self):
+        """ Health check : the worker is running and answers """
+        if self._process is None or self._process.poll() is not None:
+            return False
+        answer = self._request("PING", self.start_timeout)
+        return answer is not None and answer.startswith("PONG")
+
+    def _request(self, line, timeout):
+        # Sends a request and gives the answer, None if the worker died or did not answer in time
+        try:
+            self._process.stdin.write(line + "\n")
+            self._process.stdin.flush()
+        except (OSError, ValueError):
+            return None
+        try:
+            answer = self._answers.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if answer is None:
+            # end of its output : the worker is exiting, it is waited for so that poll() knows it exited
+            try:
+                self._process.wait(self.start_timeout)
+            except subprocess.TimeoutExpired:
+                pass
+            return None
+        return answer.strip()
+
+    def extract(self, midi, values, descriptions):
+        """ Runs jSymbolic on midi (file or folder), which writes the xml files values and descriptions. """
+        request = "\t".join(["EXTRACT"] + [os.path.abspath(path) for path in (midi, values, descriptions)])
+        for attempt in range(2):
+            if self._process is None or self._process.poll() is not None:
+                self.start()
+            answer = self._request(request, self.timeout)
+            if answer == "OK":
+                return
+            if answer is not None:
+                raise RuntimeError("jSymbolic failed on %s : %s" % (midi, answer))
+            status = self._process.poll()
+            if status is not None:
+                self.exits += 1
+                print("Warning : the jSymbolic worker exited during an extraction (status %s, %s times so far), it is "
+                      "started again for the next one" % (status, self.exits))
+                if os.path.isfile(values):
+                    return  # it exited once done (e.g. System.exit in jSymbolic)
+            self.close()  # no answer in time : the worker is killed and started again
+        raise RuntimeError("the jSymbolic worker did not answer for %s" % midi)
+
+    def close(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            self._process = None
+            self._answers = None
+
+
+def _read_lines(stdout, answers):
+    # Runs in a thread : puts each line the worker writes in answers, then None when its output is closed
+    for line in stdout:
+        answers.put(line)
+    answers.put(None)
+
+
+def get_worker():
+    """ :return: the FeatureWorker used by run_jsymbolic, None if there is none (cf persistent) """
+    global _worker
+    if _worker is None and persistent:
+        command = worker_command or server_command()
+        if command is not None:
+            _worker = FeatureWorker(command)
+            atexit.register(_worker.close)
+    return _worker
+
+
+def run_jsymbolic(midi, folder="."):
+    """
+    Runs jSymbolic on a midi file or a folder of midi files.
+    :param midi: path of the file or folder
+    :param folder: folder where jSymbolic writes its xml files, they are removed afterwards
+    :return: list of tuples (name of the midi file, features), in the order of the xml file
+    """
+    values, descriptions = os.path.join(folder, 'feature_values.xml'), os.path.join(folder, 'feature_descriptions.xml')
+    worker = get_worker()
+    if worker is not None:
+        worker.extract(midi, values, descriptions)
+    else:
+        FNULL = open(os.devnull, 'w')
+        subprocess.call(['java', '-Xmx1048m', '-jar', jar, midi,
+                         values, descriptions], stdout=FNULL, stderr=subprocess.STDOUT)
 
     # jSymbolic can create csv of arff files if some special features are extracted, it is not the case here
-    files = ['feature_descriptions.xml']
-    os.remove(files[0])
+    os.remove(descriptions)
 
-    X = ET.parse('feature_values.xml').getroot()
+    X = ET.parse(values).getroot()
 
-    features = []
+    songs = []
     for song in X[1:]:  # remove the header
         feat = []
-        for feature in song[1:]:  # remove the header
+        for feature in song[1:]:  # remove the header (the path of the midi file)
             feat.append(float(feature[1].text.replace(',', '.')))  # commas in XML files have to be turned into dot
-        features.append(feat)
-    os.remove('feature_values.xml')
+        songs.append((os.path.basename(song[0].text.strip()), feat))
+    os.remove(values)
+
+    return songs
+
+
+def get_features(midi):
+    """function creates feature_values.xml file which contains features for subsequent parsing """
+    # after calling this function jSymbolic will create 3 useless (in our case) files
+    return [feat for _, feat in run_jsymbolic(midi)]
+
 
-    return features
+def extract_features(midis):
+    """
+    Extracts the features of midi files given as bytes (cf musicGeneration.runFromData). They are written in a scratch
+    folder, that is removed afterwards. Each file is named after its position in midis, and the features are given
+    back to the individuals through this manifest, whatever the order in which jSymbolic lists the files.
+    :param midis: dictionary individual: bytes of its midi file
+    :return: dictionary individual: features. Individuals whose file was not read by jSymbolic are missing.
+    """
+    with tempfile.TemporaryDirectory(prefix="jsymbolic_", dir=scratch_root) as folder:
+        os.mkdir(os.path.join(folder, "midi"))
+        manifest = {}  # file name: individual
+        for k, (individual, midi) in enumerate(midis.items()):
+            manifest["%s.mid" % k] = individual
+            with open(os.path.join(folder, "midi", "%s.mid" % k), "wb") as file:
+                file.write(midi)
+        return {manifest[name]: feat for name, feat in run_jsymbolic(os.path.join(folder, "midi"), folder)
+                if name in manifest}
@@ -0,0 +1,60 @@
+"""
+Stand-in for the jSymbolic worker (cf jSymbolic.FeatureWorker) : it answers the same requests without java, with fake
+features computed from the bytes of each midi file. Enough to run the whole pipeline, e.g. to test it. Use it with
+jSymbolic.worker_command = [sys.executable, "jSymbolicStub.py"]. With --exit, it behaves like the server when
+System.exit can not be blocked : it answers "PONG unguarded" and exits after each extraction without answering.
+"""
+import hashlib
+import os
+import sys
+from xml.sax.saxutils import escape
+
+
+def feature_names(config="jSymbolicDefaultConfigs.txt"):
+    # features listed in the configuration of jSymbolic
+    lines = open(config).read().splitlines()
+    names = lines[lines.index("<features_to_extract>") + 1:]
+    return [name for name in names if name != "" and not name.startswith("<")]
+
+
+def extract(midi, values, descriptions):
+    """ Writes the xml files jSymbolic would write for midi (a file or a folder). """
+    if os.path.isdir(midi):
+        files = [os.path.join(midi, name) for name in sorted(os.listdir(midi)) if name.endswith(".mid")]
+    else:
+        files = [midi]
+    names = feature_names()
+    songs = []
+    for filename in files:
+        digest = hashlib.sha1(open(filename, "rb").read()).digest()
+        features = "".join("<feature><name>%s</name><v>%s</v></feature>" % (escape(name), digest[k % len(digest)] / 10)
+                           for k, name in enumerate(names))
+        songs.append("<data_set><data_set_id>%s</data_set_id>%s</data_set>" % (escape(filename), features))
+    with open(values, "w") as f:
+        f.write("<feature_vector_file><comments></comments>%s</feature_vector_file>" % "".join(songs))
+    with open(descriptions, "w") as f:
+        f.write("<feature_key_file></feature_key_file>")
+
+
+def serve(exit_after_extract=False):
+    # same protocol as JSymbolicServer.java
+    for line in sys.stdin:
+        request = line.rstrip("\n").split("\t")
+        if request[0] == "PING":
+            answer = "PONG unguarded" if exit_after_extract else "PONG"
+        elif request[0] == "EXTRACT" and len(request) == 4:
+            try:
+                extract(*request[1:])
+                if exit_after_extract:
+                    sys.exit(0)
+                answer = "OK"
+            except Exception as e:
+                answer = "ERROR %r" % e
+        else:
+            answer = "ERROR unknown request %s" % request[0]
+        sys.stdout.write(answer + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    serve("--exit" in sys.argv[1:])
@@ -2,92 +2,197 @@
 Main file, where initial population is generated, then evolution is performed and the best of generation are saved.
 """
 import musicGeneration
+import graphCompiler
 import jSymbolic
 import mgGP
 import fitness as f
-import musicGraph as mg
-import os
 import joblib as jl
-from shutil import copyfile
+from collections import Counter
+from fitnessCache import FitnessCache
+from renderPool import RenderPool
 
 pop_size = 100
 best_kept = 5
+# Individuals whose notes are all the same (or whose variety is below min_variety, cf musicGeneration.prescreen) are
+# given floor_fitness without being rendered. Silent ones are removed, as before.
+floor_fitness = 0.
+min_variety = 0.
+# The bytes of the midi files are only kept in the cache when keep_midi is True (they take a lot of memory with a large
+# cache), the best individual of each generation is written from the midi files of the generation or generated again
+keep_midi = False
+# With several workers, the individuals are built, run and rendered by a pool of processes (cf renderPool). Each
+# worker runs its individuals one by one : the subgraph table and the incremental evaluation of the children from the
+# values of their parents (references) are only used with a single worker, where the population is run in one batch.
+# This batch is faster than the pool (which was measured about twice as slow), so the pool is not used by default.
+workers = 1
 
-files = [file for file in os.listdir("midifiles") if file.endswith(".mid")]
-for file in files:
-    os.remove("midifiles/" + file)
+# The evolution only runs when this file is run directly : the workers of the pool import it again when processes are
+# spawned (on Windows and macOS), and must not start an evolution of their own.
+if __name__ == "__main__":
+    schema = graphCompiler.cast_schema(musicGeneration.get_data())
+    # Individuals that were already evaluated are not evaluated again. Give it a path to keep it from one run to
+    # another : it is saved at each generation, and only loaded back if the schema and the model did not change.
+    cache = FitnessCache(identity=FitnessCache.make_identity(musicGeneration.schema_file, f.model_path))
+    # Values of the subgraphs already computed, subgraphs shared by several individuals are computed once
+    table = graphCompiler.SubgraphTable()
+    pool = RenderPool(musicGeneration.schema_file, processes=workers, min_variety=min_variety) if workers > 1 else None
 
-init = mgGP.create_population(pop_size)
-chromosomes = []
-print("Initial population generating...")
+    # Values of the nodes of the individuals of the population, their children are run incrementally from them
+    references = {}
 
-for k in range(pop_size):
-    out = musicGeneration.runFromData(music_graph=init[k], cmpt=k)
-    if out:
-        chromosomes.append(init[k].to_array())
+    population = mgGP.create_population(pop_size)
+    print("Initial population generating...")
 
-print("Initial population generated !")
-print("Extracting features...")
+    # The midi files are kept in memory, individuals rejected by the pre-screen are not rendered
+    midis, rejected = {}, {}
+    if pool is not None:
+        for k, (midi, reason) in enumerate(pool.render(population)):
+            if reason is None:
+                midis[k] = midi
+            else:
+                rejected[k] = reason
+    else:
+        programs = [graphCompiler.simplify_program(graphCompiler.compile_genes(genes)) for genes in population]
+        init, values = graphCompiler.run_population(programs, schema, keep_values=True, table=table)
+        for k, reason in enumerate(musicGeneration.prescreen(init, min_variety)):
+            references[cache.key(population[k])] = (programs[k], values[k])
+            if reason is None:
+                midis[k] = musicGeneration.runFromData(results=init[k], as_bytes=True)
+            else:
+                rejected[k] = reason
 
-features = jSymbolic.get_features("midifiles")
+    print("Initial population generated !")
+    print("Extracting features...")
 
-print("Features extracted !")
-print("Calculating fitness...")
+    features = jSymbolic.extract_features(midis)
+    z = [k for k in midis if k in features]
 
-f_pop = f.fitness(features)
+    print("Features extracted !")
+    print("Calculating fitness...")
 
-print("Fitness calculated !")
-print("Evolution start")
-best_of_gen = [ANCESTORS for (F_POP, ANCESTORS) in sorted(zip(f_pop, chromosomes), reverse=True)][:best_kept]
+    f_pop = f.fitness([features[k] for k in z])
+    for k, fit_k in zip(z, f_pop):
+        cache.put(cache.key(population[k]), fit_k, features[k], midis[k] if keep_midi else None)
+    # Individuals that give an empty midi file are removed, the other rejected ones are kept with the lowest fitness
+    for k, reason in rejected.items():
+        if reason != "silent":
+            z.append(k)
+            f_pop.append(floor_fitness)
+            cache.put(cache.key(population[k]), floor_fitness)
+    chromosomes = [population[k] for k in z]
+    print("Rejected :", dict(Counter(rejected.values())))
 
-for j in range(100):
-    # Chromosomes
-    population = mgGP.evolve(chromosomes, f_pop, generations=1)
-    chromosomes = []  # stores the chromosomes
-    init = []  # stores the graph
+    print("Fitness calculated !")
+    print("Evolution start")
+    best_of_gen = [ANCESTORS for (F_POP, ANCESTORS) in sorted(zip(f_pop, chromosomes), key=lambda x: x[0],
+                                                                       reverse=True)][:best_kept]
 
-    for i in range(len(population)):  # Generate empty graphs, then fill them using arrays
-        tmp = mg.MusicGraph(inputs={"X": mgGP.x, "Y": mgGP.y, "Z": mgGP.z, "beat": mgGP.beat, "bar": mgGP.bar},
-                # outputs=["output1", "output2", "output3"],
-                internal_nodes_n=0, connect=False)
-        tmp.array_to_graph(population[i])
-        init.append(tmp)
-    # Now the graphs are done, we generate midi files
-    # First, we empty the folder that contains the old midi files
-    files = [file for file in os.listdir("midifiles") if file.endswith(".mid")]
-    for file in files:
-        os.remove("midifiles/" + file)
-    z = []
-    # This part generates the midi files
-    for k in range(pop_size):
-        out = musicGeneration.runFromData(music_graph=init[k], cmpt=k)
-        if out:
-            chromosomes.append(init[k].to_array())
-            z.append(k)
-    # We use jSymbolic to extract features from these files
-    features = jSymbolic.get_features("midifiles")
-    # Fitness is calculated
-    f_pop = f.fitness(features)
-    #f_pop = [init[k].variety() for k in range(len(init))]
-    # The 5 best individuals are stored and re-generated later
-    best_of_gen += [ANCESTORS for (F_POP, ANCESTORS) in sorted(zip(f_pop, chromosomes),  key=lambda x: x[0], reverse=True)][:best_kept]
-    # The best individual is stored separately
-    copyfile("midifiles/test%s.mid" % z[f_pop.index(max(f_pop))], "best/gen%s_test%s_fit%.3f.mid" % (j, z[f_pop.index(max(f_pop))], max(f_pop)))
-    # If fitness is high enough, not only the midi file is stored, but also its list representation
-    if max(f_pop) > 0.6:
-        jl.dump(max(f_pop), "gen%s_fit%.3f.pkl" % (j, max(f_pop)))
-    print("\nGeneration :", j)
-    print("Max fitness :", max(f_pop))
+    for j in range(100):
+        cache.reset_stats()
+        table.reset_stats()
+        if pool is not None:
+            pool.reset_stats()
+        # Chromosomes
+        population, first_parents = mgGP.evolve(chromosomes, f_pop, generations=1, with_parents=True)
+        keys = [cache.key(genes) for genes in population]
+        # Individuals already evaluated (elites, duplicates created by crossover) are taken from the cache
+        entries = {}
+        for key in keys:
+            if key not in entries:
+                entries[key] = cache.get(key)
+        todo = [keys.index(key) for key in entries if entries[key] is None]
+        # Compile and simplify the arrays and run the remaining individuals at once, no graph is needed.
+        # init stores the notes and velocities of each individual
+        programs = [graphCompiler.compile_genes(genes) for genes in population]
+        counts = [graphCompiler.node_counts(program) for program in programs]
+        programs = [graphCompiler.simplify_program(program) for program in programs]
+        simplified = [graphCompiler.node_counts(program)[0] for program in programs]
+        midis, rejected = {}, {}
+        if pool is not None:
+            # Each worker builds, runs, screens and renders its individuals from their arrays
+            for k, (midi, reason) in zip(todo, pool.render([population[k] for k in todo])):
+                if reason is None:
+                    midis[k] = midi
+                else:
+                    rejected[k] = reason
+        else:
+            # Children are run from the values of their first parent, only the nodes that changed are computed
+            init, values = graphCompiler.run_population([programs[k] for k in todo], schema,
+                                                        references=[references.get(cache.key(first_parents[k]))
+                                                                    for k in todo],
+                                                        keep_values=True, table=table)
+            # The references of the individuals that are still in the population are kept
+            new_references = {key: references[key] for key in keys if key in references}
+            for k, v in zip(todo, values):
+                new_references[keys[k]] = (programs[k], v)
+            references = new_references
+            # Now the graphs are run, we generate midi files, in memory, except for the individuals that are not worth
+            # it
+            for k, results, reason in zip(todo, init, musicGeneration.prescreen(init, min_variety)):
+                if reason is None:
+                    midis[k] = musicGeneration.runFromData(results=results, as_bytes=True)
+                else:
+                    rejected[k] = reason
+        # We use jSymbolic to extract features from these files, they are given back to each individual by name
+        features = jSymbolic.extract_features(midis) if len(midis) > 0 else {}
+        rendered = [k for k in midis if k in features]
+        failed = [k for k in midis if k not in features]
+        for k in rejected:
+            entries[keys[k]] = cache.put(keys[k], None if rejected[k] == "silent" else floor_fitness)
+        # Individuals whose midi file was not read by jSymbolic are removed from this generation, but not cached : they
+        # will be evaluated again if they come back
+        for k in failed:
+            entries[keys[k]] = {"fitness": None, "features": None, "midi": None}
+        if len(rendered) > 0:
+            # Fitness is calculated
+            for k, fit_k in zip(rendered, f.fitness([features[k] for k in rendered])):
+                entries[keys[k]] = cache.put(keys[k], fit_k, features[k], midis[k] if keep_midi else None)
+        # Individuals that give an empty midi file are removed
+        z = [k for k in range(len(population)) if entries[keys[k]]["fitness"] is not None]
+        chromosomes = [population[k] for k in z]
+        f_pop = [entries[keys[k]]["fitness"] for k in z]
+        #f_pop = [init[k].variety() for k in range(len(init))]
+        # The 5 best individuals are stored and re-generated later
+        best_of_gen += [ANCESTORS for (F_POP, ANCESTORS) in sorted(zip(f_pop, chromosomes),  key=lambda x: x[0], reverse=True)][:best_kept]
+        # The best individual is stored separately
+        best = f_pop.index(max(f_pop))
+        best_midi = midis[z[best]] if z[best] in midis else entries[keys[z[best]]]["midi"]
+        if best_midi is None:  # the best individual comes from the cache without its midi file, it is generated again
+            results = graphCompiler.run_program(graphCompiler.compile_genes(chromosomes[best]), schema)
+            best_midi = musicGeneration.runFromData(results=results, as_bytes=True)
+        with open("best/gen%s_test%s_fit%.3f.mid" % (j, z[best], max(f_pop)), "wb") as midi:
+            midi.write(best_midi)
+        # If fitness is high enough, not only the midi file is stored, but also its list representation
+        if max(f_pop) > 0.6:
+            jl.dump(max(f_pop), "gen%s_fit%.3f.pkl" % (j, max(f_pop)))
+        print("\nGeneration :", j)
+        print("Max fitness :", max(f_pop))
+        print("Cache :", cache.stats())
+        print("Rejected :", dict(Counter(rejected.values())))
+        if len(failed) > 0:
+            print("Extraction failed :", len(failed))
+        if pool is not None:
+            print("Workers :", pool.stats())
+        else:
+            print("Subgraphs :", table.stats())
+        print("Active nodes : %.1f / %.1f" % (sum(c[0] for c in counts) / len(counts), sum(c[1] for c in counts) / len(counts)))
+        # Number of active nodes removed by the simplification, for each individual
+        reductions = Counter(c[0] - n for c, n in zip(counts, simplified))
+        print("Simplified : %.1f active nodes, %d individuals reduced" %
+              (sum(simplified) / len(simplified), sum(c[0] > n for c, n in zip(counts, simplified))))
+        print("Nodes removed : %s" % ", ".join("%s: %s individuals" % (removed, nb)
+                                                for removed, nb in sorted(reductions.items())))
+        cache.save()
 
-print("Evolution over")
-print("Saving best midi files...")
+    print("Evolution over")
+    if pool is not None:
+        pool.close()
+    print("Saving best midi files...")
 
-i = 0
-# Re-generate 5 best songs
-for song in best_of_gen:
-    tmp = mg.MusicGraph(inputs={"X": mgGP.x, "Y": mgGP.y, "Z": mgGP.z, "beat": mgGP.beat, "bar": mgGP.bar},
-                        # outputs=["output1", "output2", "output3"],
-                        internal_nodes_n=0, connect=False)
-    tmp.array_to_graph(song)
-    musicGeneration.runFromData(music_graph=tmp, cmpt="gen%s_%s" % (int(i/5), i))
-    i += 1
+    musicGeneration.clear_midifiles()
+    i = 0
+    # Re-generate 5 best songs
+    for song in best_of_gen:
+        results = graphCompiler.run_program(graphCompiler.compile_genes(song), schema)
+        musicGeneration.runFromData(results=results, cmpt="gen%s_%s" % (int(i/5), i))
+        i += 1
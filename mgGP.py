@@ -4,18 +4,10 @@ Genetic component of the program. Supports mutation, crossover and elitism, gene
 import random
 
 import numpy as np
-import fitness as fit
-from musicGeneration import data
-from musicGraph import *
+from nodeFunctions import inputs, node_types, nb_out, max_arity
 segment_size = 3
 nb_node = 20
 
-bar = data[:][0]
-beat = data[:][1]
-x = data[:][2]
-y = data[:][3]
-z = data[:][4]
-
 
 def mutate(individual, probability=0.05):
     # Probabilty could be changed, or could be applied to 5% of the population, instead of 5% of each values.
@@ -48,13 +40,30 @@ def crossover(ind_f, ind_s, min_size=12):
     return child
 
 
+def random_genes(internal_nodes_n=nb_node):
+    """
+    Random array, drawn like the graphs of MusicGraph.connect_random : each internal node has a random function and
+    random parents among the inputs and the nodes before it (one parent for unary functions), each output has two
+    parents among the inputs and all the internal nodes. No graph is built nor run. The nodes that are not connected
+    to any output keep their random genes, crossover and mutation can connect them later.
+    :return: array
+    """
+    genes = []
+    for node in range(internal_nodes_n + nb_out):
+        eligible = inputs + list(range(min(node, internal_nodes_n)))
+        if node >= internal_nodes_n:
+            function, pred = 0, random.sample(eligible, 2)
+        else:
+            function = random.randint(0, len(node_types) - 1)
+            pred = [random.choice(eligible)] if node_types[function].find("UNARY") != -1 else random.sample(eligible, 2)
+        genes += [function] + pred + pred[:max_arity - len(pred)]
+    return genes
+
+
 def create_population(amount):
-    dump = []
-    for k in range(amount):
-        dump.append(MusicGraph(inputs={"X": x, "Y": y, "Z": z, "beat": beat, "bar": bar},
-                outputs=["output1", "output2", "output3"],
-                internal_nodes_n=nb_node, connect=True))
-    return dump
+    # Arrays of the initial population, cf random_genes. Use MusicGraph.array_to_graph to get the graphs, e.g. to plot
+    # them.
+    return [random_genes() for k in range(amount)]
 
 
 def elitism(ancestors, f_pop, proportion=0.2):
@@ -80,18 +89,27 @@ def get_statistics(population):
     print(best, best_f, worst_f, mean_f, best_size)
 
 
-def evolve(population, f_pop, generations=100):
+def evolve(population, f_pop, generations=100, with_parents=False):
+    """
+    :param with_parents: if True, also returns, for each individual of the last generation, the array it comes from :
+    itself for the elites, the first parent (whose beginning it keeps) for the others. Used to run the children
+    incrementally, cf graphCompiler.reusable_nodes.
+    """
     for i in range(generations):
         # elitism
         new_population, new_f_pop = elitism(population, f_pop)
         tmp = new_population[:]
+        first_parents = tmp[:]
         for k in range(len(tmp), 100):
             parents = random.sample(tmp, 2)
             # crossover
             new_population.append(crossover(parents[0], parents[1]))
             # mutation
             new_population[k] = mutate(new_population[k])
+            first_parents.append(parents[0])
         population = new_population[:]
+    if with_parents:
+        return population, first_parents
     return population
 
 
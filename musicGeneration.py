@@ -1,19 +1,25 @@
 """
 The main fonction runFromData generates midi files given a music Graph.
+Importing this file has no side effect : the schema is only loaded when it is first needed (cf get_data), and the
+midifiles folder is only emptied by clear_midifiles.
 """
 import csv
 import os
-import matplotlib.pyplot as pl
+import struct
 import mido
-import musicGraph
-import networkx
+import numpy as np
+import generateXYZ
+from nodeFunctions import nb_out
 
-nb_out = musicGraph.nb_out
+schema_file = 'schema/AABA_3_4.txyz'
+_data = None
 
-# Empty the folder that contains the midi files.
-f = [file for file in os.listdir("midifiles") if file.endswith(".mid")]
-for file in f:
-    os.remove("midifiles/"+file)
+
+def clear_midifiles():
+    # Empty the folder that contains the midi files.
+    f = [file for file in os.listdir("midifiles") if file.endswith(".mid")]
+    for file in f:
+        os.remove("midifiles/"+file)
 
 
 # Deprecated
@@ -56,30 +62,230 @@ def parse_xyz(filename):
                 out[k].append(float(row[k]))
     return out
 
-data = parse_xyz('schema/AABA_3_4.txyz')
 
-t = data[:][0]  # bar
-b = data[:][1]  # beat
-x = data[:][2]
-y = data[:][3]
-z = data[:][4]
+def iter_txyz(filename, chunk_size=4096):
+    """
+    Reads a txyz file chunk by chunk, so that a long piece never has to be loaded at once.
+    :param chunk_size: number of steps of each chunk (the last one may be shorter)
+    :return: generator of lists of 5 lists : "bar", "beat", "x", "y" and "z"
+    """
+    out = [[], [], [], [], []]
+    with open(filename, "r") as f:
+        reader = csv.reader(f, delimiter=' ')
+        for row in reader:
+            for k in range(5):
+                out[k].append(float(row[k]))
+            if len(out[0]) == chunk_size:
+                yield out
+                out = [[], [], [], [], []]
+    if len(out[0]) > 0:
+        yield out
+
+
+def load_xyz(filename):
+    """
+    Loads a schema without parsing it : the binary file (cf generateXYZ) is memory-mapped read-only, so the values are
+    only read when they are used, and processes that load the same schema share the same memory. A txyz file is
+    converted once into a xyzb file next to it, which is used as long as the txyz file is not modified. The conversion
+    reads the txyz file chunk by chunk (cf iter_txyz), so it never has to be loaded at once either.
+    :param filename: txyz or xyzb file
+    :return: list of 5 read-only arrays : "bar", "beat", "x", "y" and "z"
+    """
+    if filename.endswith(".txyz"):
+        binary = filename[:-len(".txyz")] + ".xyzb"
+        mtime = os.path.getmtime(filename)
+        if not os.path.isfile(binary) or generateXYZ.read_xyzb_header(binary)[0].get("source_mtime") != mtime:
+            with open(filename, "r") as f:
+                length = sum(1 for row in csv.reader(f, delimiter=' '))
+            generateXYZ.write_xyzb_chunks(binary, length, iter_txyz(filename), source_mtime=mtime)
+        filename = binary
+    header, offset = generateXYZ.read_xyzb_header(filename)
+    return list(np.memmap(filename, dtype=header["dtype"], mode="r", offset=offset, shape=(5, header["length"])))
+
+
+def load_schema(name):
+    """
+    :param name: either a schema file (txyz or xyzb, cf load_xyz), or the spec of a schema that is generated in memory,
+    e.g. "AABA:3:4" (cf generateXYZ.get_schema)
+    :return: list of 5 arrays : "bar", "beat", "x", "y" and "z"
+    """
+    if ":" in name:
+        return list(generateXYZ.get_schema(name))
+    return load_xyz(name)
+
+
+def iter_xyz(filename, chunk_size=4096):
+    """
+    Reads a schema chunk by chunk, so that a long piece never has to be loaded at once (cf
+    graphCompiler.stream_program). Only the pages of the current chunk of the memory-mapped file are read.
+    :param chunk_size: number of steps of each chunk (the last one may be shorter)
+    :return: generator of lists of 5 arrays : "bar", "beat", "x", "y" and "z"
+    """
+    columns = load_xyz(filename)
+    for start in range(0, len(columns[0]), chunk_size):
+        yield [column[start:start + chunk_size] for column in columns]
+
+
+def get_data():
+    """
+    Gives the default schema (schema_file, a file or a spec), which is loaded the first time this function is called.
+    :return: list of 5 arrays : "bar", "beat", "x", "y" and "z", cf load_schema
+    """
+    global _data
+    if _data is None:
+        _data = load_schema(schema_file)
+    return _data
+
+
+def load_schemas():
+    """
+    Loads every schema written by generateXYZ.py.
+    :return: dictionary filename: list of 5 arrays "bar", "beat", "x", "y" and "z" (cf load_xyz), in the order of
+    generateXYZ.pieces
+    """
+    return {piece.filename: load_xyz(piece.filename) for piece in generateXYZ.pieces}
+
+
+def __getattr__(name):
+    # data, t (bar), b (beat), x, y and z used to be parsed on import, they are now given on demand
+    if name == "data":
+        return get_data()
+    if name in ("t", "b", "x", "y", "z"):
+        return get_data()["tbxyz".index(name)]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def note_events(notes, velocities, quantum):
+    """
+    Turns the notes and velocities of an output into midi messages, without going through the steps one by one.
+    Each step either starts a note (note > 0 and velocity > 0), stops it (velocity 0), or holds the current note or
+    silence (velocity < 0). A note is written when the next note starts or when it is stopped : its note_on is put at
+    the time of that step, and it lasts one quantum plus one per held step. When a note starts after a silence, the
+    time also jumps by the length of the silence. The last note of the piece is never written.
+    :param notes: notes of each step
+    :param velocities: velocities of each step
+    :param quantum: duration of a step, in ticks
+    :return: arrays is_note_on, note, velocity and time (relative to the previous message, as in midi files) of the
+    messages, in the order in which they are written
+    """
+    notes, velocities = np.asarray(notes), np.asarray(velocities)
+    starts = (notes > 0) & (velocities > 0)
+    steps = np.flatnonzero(starts | (velocities == 0))  # steps that start or stop a note
+    after_start = np.zeros(len(steps), dtype=bool)  # whether a note is playing before these steps
+    after_start[1:] = starts[steps][:-1]
+    ends = steps[after_start]
+    begins = steps[np.flatnonzero(after_start) - 1]
+    held = np.concatenate(([0], np.cumsum(velocities < 0)))
+    durations = quantum * (1 + held[ends] - held[begins + 1])
+
+    # Silences : steps with velocity <= 0 since the stop of the previous note (which counts as one quantum), or since
+    # the beginning of the piece
+    silent = np.concatenate(([0], np.cumsum(velocities <= 0)))
+    restarts = np.flatnonzero(starts[steps] & ~after_start)
+    last_start = np.maximum.accumulate(np.where(starts[steps], np.arange(len(steps)), -1))
+    previous = np.concatenate(([-1], last_start))[restarts]  # last start before each note that follows a silence
+    stop = steps[np.minimum(previous + 1, len(steps) - 1)]
+    rests = quantum * np.where(previous < 0, silent[steps[restarts]], 1 + silent[steps[restarts]] - silent[stop + 1])
+    rests = np.concatenate(([0], np.cumsum(rests)))
+    note_on = quantum * ends + rests[np.searchsorted(steps[restarts], ends)]
+
+    # note_on and note_off of each note, one after the other. A note_off can come after the note_on of the next notes.
+    times = np.stack((note_on, note_on + durations), axis=1).ravel()
+    order = np.argsort(times, kind="stable")
+    is_on = np.tile([True, False], len(ends))[order]
+    times = times[order]
+    return (is_on, np.repeat(notes[begins], 2)[order], np.repeat(velocities[begins], 2)[order],
+            np.diff(np.concatenate(([0], times))))
 
 
-def runFromData(data=data, music_graph=None, cmpt=0):
+def prescreen(results, min_variety=0.):
+    """
+    Finds the individuals that are not worth a midi file, jSymbolic and the classifier, from their notes and velocities
+    only, for a whole population at once :
+    - "silent" : no note is ever written (cf note_events), runFromData would give an empty file,
+    - "constant pitch" : every note written has the same pitch,
+    - "low variety" : variety (number of different notes / number of steps, averaged over the outputs, cf
+      CompactMusicGraph.variety) below min_variety. It is at least 1 / number of steps, so 0 disables this test.
+    :param results: list of arrays of shape nb_out*2*len(schema), as given by graphCompiler.run_population
+    :return: list of reasons, None for the individuals that pass
+    """
+    if len(results) == 0:
+        return []
+    results = np.asarray(results)
+    notes, velocities = results[:, :, 0], results[:, :, 1]
+    length = notes.shape[-1]
+    starts = (notes > 0) & (velocities > 0)
+    steps = starts | (velocities == 0)
+    # a note is written when a step after its start starts or stops a note
+    first_start = np.where(starts.any(axis=-1), starts.argmax(axis=-1), length)
+    last_step = length - 1 - steps[..., ::-1].argmax(axis=-1)
+    written = steps.any(axis=-1) & (first_start < last_step)
+    silent = ~written.any(axis=1)
+
+    # pitches of the notes written : every start followed by a step that starts or stops a note
+    pitches = np.where(starts & (np.arange(length) < last_step[..., None]), notes, np.nan).reshape(len(results), -1)
+    with np.errstate(invalid='ignore'):
+        constant = np.nanmin(np.where(silent[:, None], 0, pitches), axis=1) == \
+            np.nanmax(np.where(silent[:, None], 0, pitches), axis=1)
+    different = 1 + (np.diff(np.sort(notes, axis=-1), axis=-1) != 0).sum(axis=-1)
+    variety = (different / length).mean(axis=1)
+
+    reasons = np.where(silent, "silent", np.where(constant, "constant pitch",
+                                                  np.where(variety < min_variety, "low variety", "")))
+    return [reason if reason != "" else None for reason in reasons.tolist()]
+
+
+def midi_file(tracks, ticks_per_beat=480):
+    """
+    Writes a type 1 midi file without building mido messages. The bytes are the ones mido.MidiFile.save writes for the
+    same messages : running status (the status byte is omitted when it is the same as the one of the previous message)
+    and an end_of_track at the end of each track. ticks_per_beat is the default of
+    mido.MidiFile, which runFromData has always used (tpb only sets the length of a step).
+    :param tracks: list of tuples (channel, program, events), events being the arrays given by note_events
+    :return: bytes of the file
+    """
+    data = bytearray(b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks), ticks_per_beat))
+    for channel, program, (is_on, notes, velocities, times) in tracks:
+        times = np.asarray(times, dtype=np.int64)
+        # times are written as variable-length quantities : 7 bits per byte, most significant first, the highest bit
+        # set on every byte but the last one
+        nb_bytes = 1 + (times >= 1 << 7) + (times >= 1 << 14) + (times >= 1 << 21)
+        events = np.empty((len(times), 7), dtype=np.uint8)
+        events[:, :4] = (times[:, None] >> np.array([21, 14, 7, 0])) & 0x7f | np.array([0x80, 0x80, 0x80, 0])
+        events[:, 4] = np.where(is_on, 0x90, 0x80) | channel
+        events[:, 5] = notes
+        events[:, 6] = velocities
+        used = np.ones(events.shape, dtype=bool)
+        used[:, :4] = np.arange(4) >= 4 - nb_bytes[:, None]
+        used[1:, 4] = events[1:, 4] != events[:-1, 4]
+        track = bytes([0, 0xc0 | channel, program]) + events[used].tobytes() + b"\x00\xff\x2f\x00"
+        data += b"MTrk" + struct.pack(">I", len(track)) + track
+    return bytes(data)
+
+
+def runFromData(data=None, music_graph=None, cmpt=0, results=None, as_bytes=False):
     """
     Generates a MIDI file given time and data array. Implementation is the same as in the original paper.
     Some mistakes may have been made, especially in the case where input_vel == 0.
     :param music_graph: graph that will be run
     :param filename: txyz file. Turned into list of 5 lists of length data.length : "bar", "beat", "x", "y" and "z"
-    :return: null (or a MIDI format object ?)
+    :param results: notes and velocities of each output, as given by graphCompiler.run_program. If it is given,
+    music_graph is not used.
+    :param as_bytes: if True, the midi file is returned instead of being saved in midifiles/test<cmpt>.mid
+    :return: whether the midi file is not empty (it is not saved if it is). If as_bytes, the bytes of the midi file,
+    or None if it is empty.
     """
-    mid = mido.MidiFile()
+    if data is None:
+        data = get_data()
+    t, b, x, y, z = data
     tpb = 3
     # results is of shape 2*len(data)*nb_out, which means there are nb_out tracks, which contains len(data) steps
     # which contains 2 information : the note and its velocity
-    results = [[[0 for i in range(len(data))] for k in range(2)] for j in range(nb_out)]
-    if music_graph is None:
+    if results is not None:
+        mg = None
+    elif music_graph is None:
         # This case is deprecated
+        import musicGraph  # networkx is only imported when needed
 
         curves = [x, y, z]
         times = [t, b]
@@ -91,89 +297,29 @@ def runFromData(data=data, music_graph=None, cmpt=0):
     else:
         mg = music_graph
 
-    for node in mg._outputs:
-        for k in range(2):
-            r = mg.node[node]["values"][k]
-            results[mg._outputs.index(node)][k] = r
+    if mg is not None:
+        results = [[[0 for i in range(len(data))] for k in range(2)] for j in range(nb_out)]
+        for node in mg._outputs:
+            for k in range(2):
+                r = mg.node[node]["values"][k]
+                results[mg._outputs.index(node)][k] = r
     # mg.plot()
     # We chose the instruments arbitrarily. Use Fruity Loops to change them afterward if you want.
     # Cf Midi documentation : for percussion, we need to use channel 10 and program 0.
     instruments = [29, 0, 33]
     # Once results is computed, it is turned into MIDI file
+    quantum = int(mido.second2tick(1./96., tpb, 120))  # time unit, in ticks
+    tracks = []
     for i in range(nb_out):
-        track = mido.MidiTrack()
         chan = i
         if i == 1:
             chan = 9
-        track.append(mido.Message("program_change", program=instruments[i], time=0, channel=chan))
-        cur_note = results[i][0][0]
-        cur_vel = results[i][1][0]
-        quantum = int(mido.second2tick(1./96., tpb, 120))  # time unit, in ticks
-        cur_dur = 0  # duration of a note
-        abs_time = 0
-        # state machine : 0 means a note is playing, 1 means no note is playing
-        state = 1
-        for j in range(len(x)+1):
-
-            if j == len(x):
-                input_note = 1
-                input_vel = 1   # puts a note_off at the end
-                state = 1
-            else:
-                input_note = results[i][0][j]
-                input_vel = results[i][1][j]
-
-            if state == 0:
-                if input_vel < 0:  # keep on playing the note
-                    cur_dur += quantum
-                elif input_vel == 0:  # note_off, end the note. For now, we put absolute time in each note
-                    track.append(mido.Message("note_on", note=cur_note, velocity=cur_vel, channel=chan, time=abs_time))
-                    track.append(mido.Message("note_off", note=cur_note, velocity=cur_vel, channel=chan, time=abs_time+cur_dur))
-                    cur_dur = quantum  # resets duration of note
-                    state = 1
-                elif input_note > 0 and input_vel > 0:  # note_on, add another note
-                    if False and input_note == cur_note:
-                        cur_dur += quantum  # but we could chose to create a new note instead
-                        # what about random decision ? for now, false
-                    else:
-                        track.append(mido.Message("note_on", note=cur_note, velocity=cur_vel, channel=chan, time=abs_time))
-                        track.append(mido.Message("note_off", note=cur_note, velocity=cur_vel, channel=chan,
-                                                  time=abs_time + cur_dur))
-                        cur_note = input_note
-                        cur_vel = input_vel
-                        cur_dur = quantum  # resets
-
-            elif state == 1:
-                if input_vel < 0:
-                    cur_dur += quantum
-                elif input_vel == 0:
-                    cur_dur += quantum
-                elif input_note > 0 and input_vel > 0:
-                    """while len(tmp) > 0:
-                        n, v, c, dur = tmp.pop()
-                        track.append(mido.Message("note_off", note=n, velocity=v, channel=c, time=abs_time + dur))"""
-                    cur_note = input_note
-                    cur_vel = input_vel
-                    abs_time += cur_dur  # adds a rest
-                    cur_dur = quantum  # resets
-                    state = 0
-
-            abs_time += quantum
-
-        # We turn absolute time into relative time
-        track.sort(key=lambda s: s.time)
-        last_time = 0
-        new_track = mido.MidiTrack()
-
-        for message in track:
-            message.time -= last_time
-            last_time += message.time
-            new_track.append(message)
-
-        mid.tracks.append(new_track)
+        tracks.append((chan, instruments[i], note_events(results[i][0], results[i][1], quantum)))
     # We test that the midi file is not empty (this happens between 10 and 20% of the time)
-    if len(mid.tracks[0]) + len(mid.tracks[1]) + len(mid.tracks[2]) != 3:
-        mid.save("midifiles/test%s.mid" % cmpt)
-        return True
-    else:
-        return False
+    if not any(len(events[0]) > 0 for _, _, events in tracks):
+        return None if as_bytes else False
+    if as_bytes:
+        return midi_file(tracks)
+    with open("midifiles/test%s.mid" % cmpt, "wb") as midi:
+        midi.write(midi_file(tracks))
+    return True
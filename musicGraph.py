@@ -2,59 +2,17 @@
 This file contains the class MusicGraph that is used to generate midi files.
 """
 import networkx as nx
-import matplotlib.pyplot as plt
 import numpy as np
 import random
 
-nb_out = 3  # number of nodes "output", which is the number of tracks
-max_arity = 2  # maximum number of input for a particular node
-node_types = ["UNARY_MIN", "EDGE", "UNARY_PLUS","MOD", "DIV", "COS", 'SIN', "SUM", "MULT", "LOG", "EXP", "DELTA"]  # does NOT contain output
-inputs = ["X", "Y", "Z", "bar", "beat"]
-
-
-def delta(x, y):
-    threshold = 0.1
-    if np.abs(x-y) < threshold:
-        return 1
-    else:
-        return 0
-
-
-def edge(x):
-    if x < 0 or x > 10:
-        return 0
-    else:
-        return np.power(1 - x / 10, 5)
-
-
-def protected_divide(x,y):
-    if np.abs(y).all() < 0.00001:
-        return x
-    else:
-        return np.array(x)/np.array(y)
-
-
-def protected_mod(x,y):
-    if np.abs(y).all() < 0.00001:
-        return x
-    else:
-        return np.array(x)%np.array(y)
+from nodeFunctions import nb_out, max_arity, node_types, inputs, delta, edge, mean, protected_divide, protected_mod, \
+    dict_functions, midiMap, midi_table, activity_levels, output, output_chunk
 
 
 # Main class that creates and manages Graphs
 class MusicGraph(nx.DiGraph):
-    dict_functions = {"SUM": lambda x, y: np.array(x) + np.array(y),
-                      "DELTA": lambda x, y: np.array([delta(x[k], y[k]) for k in range(len(x))]),
-                      "EDGE": lambda x, y: np.array([edge(x[k]) for k in range(len(x))]),
-                      "MULT": lambda x, y: np.array(x)*np.array(y),
-                      "DIV": lambda x, y: protected_divide(x, y),
-                      "MOD": lambda x, y: protected_mod(x,y),
-                      "SIN": lambda x, y: np.sin(([(x[k]+y[k])/2 for k in range(len(x))])),
-                      "COS": lambda x, y: np.cos(([(x[k]+y[k])/2 for k in range(len(x))])),
-                      "UNARY_MIN": lambda x: -np.array(x),
-                      "UNARY_PLUS": lambda x: np.array(x) + 1,
-                      "LOG": lambda x, y: np.array(np.log(0.00001 + np.abs([(x[k]+y[k])/2 for k in range(len(x))]))),
-                      "EXP": lambda x, y: np.array(np.exp(np.abs([(x[k]+y[k])/2 for k in range(len(x))])))}
+    # cf nodeFunctions
+    dict_functions = dict_functions
 
     f_node = [{"name": fname, "binary": False if fname.find('UNARY') != -1 else True} for fname in dict_functions]
 
@@ -242,45 +200,24 @@ class MusicGraph(nx.DiGraph):
 
     def to_array(self):
         """
-        Gives the array associated with the graph. Note that this array is not unique, since we use a topological sort
-        which is not deterministic. Hence, the Graph re-generated with this array should have the same structure, but
-        the ID of each nodes may differ, which should not change the output midi file.
+        Gives the array associated with the graph. The array is in normal form (cf graphCompiler.canonical_genes) : it
+        does not depend on the ids of the nodes, and nodes that are not connected to any output are left out. Hence,
+        graphs with the same structure give the same array, and the Graph re-generated with this array gives the same
+        midi file.
         Cf ReadMe for detailed information.
         :return: array, that can be fed to self.array_to_graph
         """
+        from graphCompiler import canonical_genes  # graphCompiler imports this module
+
+        # Internal nodes only have parents with a lower id, so they can be written in the order of their ids
         array = []
-        new_node_id = {}
-        compt = 0
-        for node in [node for node in nx.topological_sort(self) if isinstance(node, int)]:
-            if node in inputs:
-                continue
-            else:
-                r = [node_types.index(self.node[node]["name"])]
-                pred = self.node[node]["parents"]
-                new_node_id[node] = compt
-                compt += 1
-                for k in range(len(pred)):
-                    if pred[k] in new_node_id.keys():
-                        pred[k] = new_node_id[pred[k]]
-                r += pred
-                if len(r) == 2:
-                    r += pred
-                array += r
-        i = 0
+        for node in sorted(self.internals):
+            pred = self.node[node]["parents"]
+            array += [node_types.index(self.node[node]["name"])] + pred + pred[:max_arity - len(pred)]
         for node in self._outputs:
-            i += 1
-            r = [random.randint(0, len(node_types)-1)]
             pred = self.node[node]["parents"]
-            if node in self._outputs:
-                pred = self.node[node]["parents"]
-            for k in range(len(pred)):
-                if pred[k] in new_node_id.keys():
-                    pred[k] = new_node_id[pred[k]]
-            r += pred
-            if len(r) == 2:  # security, in case the two parents are the same
-                r += pred
-            array += r
-        return array
+            array += [0] + pred + pred[:max_arity - len(pred)]
+        return canonical_genes(array)
 
     def pos_nodes(self):
         """ Assign a position for each node for further plotting """
@@ -300,6 +237,8 @@ class MusicGraph(nx.DiGraph):
         return nx.get_node_attributes(self, 'pos')
 
     def plot(self):
+        import matplotlib.pyplot as plt  # only imported when needed, importing it is slow
+
         self.__paint()
         NODE_SIZE = 500
         nx.draw_networkx(self, node_color=self.color_map, with_labels=True, pos=self.pos_nodes(), node_size=NODE_SIZE)
@@ -315,77 +254,22 @@ class MusicGraph(nx.DiGraph):
         return retval / nb_out
 
 
-def midiMap(n):
-    # Maps a value n to a valid note.
-    octave = n / 7
-    chroma = n % 7
-    retval = octave * 12
-    if chroma == 0: return retval + 0
-    elif chroma == 1: return retval + 2
-    elif chroma == 2: return retval + 3
-    elif chroma == 3: return retval + 5
-    elif chroma == 4: return retval + 7
-    elif chroma == 5: return retval + 8
-    elif chroma == 6: return retval + 10
-
-
-def output(args):
-    """
-    The implementation is not ours, it is merely a copy of what was done in the original paper. Hence, some values are
-    chosen quite arbitrarily.
-    :param args:
-    :return:
-    """
-    note, velocity = [], []
-    activity = 0
-    for k in range(len(args[0])):
-        activityIn = abs(args[0][k])
-        activity *= 0.25
-        activity += activityIn
-        threshold = 1.5
-        value = args[1][k]
-
-        if float(activity) < 0.05 * threshold:
-            velocity.append(0)
-            try:note.append(note[-1])
-            except:note.append(0)
-        elif float(activity) < threshold:
-            velocity.append(-1)
-            try:note.append(note[-1])
-            except:note.append(0)
-        else:
-            try:
-                vel = int(50.0 + 50.0 * np.log(1.0 + activity - threshold))
-            except:
-                vel = 0
-            activity *= 0.05
-            if vel > 127:
-                velocity.append(127)
-            else:
-                velocity.append(vel)
-
-            try:  # catch fatal error, when value is NaN or infinity
-                note.append(int(midiMap(int(18 + 32 * 0.5 * (1.0 + np.tanh(value))))))
-            except:
-                value = 100
-                note.append(int(midiMap(int(18 + 32 * 0.5 * (1.0 + np.tanh(value))))))
-    return note, velocity
-
-
-# Test examples, feel free to comment it out.
-G = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
-               outputs=["output1", "output2", "output3"],
-               internal_nodes_n=20, connect=True)
+# Test examples, feel free to comment it out. They are only run when this file is run directly, since to_array
+# imports graphCompiler, which imports this module.
+if __name__ == "__main__":
+    G = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
+                   outputs=["output1", "output2", "output3"],
+                   internal_nodes_n=20, connect=True)
 
-array = G.to_array()
+    array = G.to_array()
 
-G2 = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
-                # outputs=["output1", "output2", "output3"],
-                internal_nodes_n=0, connect=False)
+    G2 = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
+                    # outputs=["output1", "output2", "output3"],
+                    internal_nodes_n=0, connect=False)
 
-G2.array_to_graph(array)
-array2 = G2.to_array()
-G3 = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
-                # outputs=["output1", "output2", "output3"],
-                internal_nodes_n=0, connect=False)
-G3.array_to_graph(array2)
+    G2.array_to_graph(array)
+    array2 = G2.to_array()
+    G3 = MusicGraph(inputs={"X": [0, 1, 1], "Y": [0, 2, 1], "Z": [0, 3, 1], "beat": [0, 4, 1], "bar": [0, 5, 1]},
+                    # outputs=["output1", "output2", "output3"],
+                    internal_nodes_n=0, connect=False)
+    G3.array_to_graph(array2)
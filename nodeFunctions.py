@@ -0,0 +1,153 @@
+"""
+Functions computed by the nodes of the graphs, and output, which turns the values of the two parents of an output node
+into notes and velocities. They are shared by MusicGraph and by graphCompiler, and do not need networkx, so that running
+the graphs does not import it (it is only needed to build and plot MusicGraph objects).
+"""
+import numpy as np
+
+nb_out = 3  # number of nodes "output", which is the number of tracks
+max_arity = 2  # maximum number of input for a particular node
+node_types = ["UNARY_MIN", "EDGE", "UNARY_PLUS","MOD", "DIV", "COS", 'SIN', "SUM", "MULT", "LOG", "EXP", "DELTA"]  # does NOT contain output
+inputs = ["X", "Y", "Z", "bar", "beat"]
+
+
+def delta(x, y):
+    # 1 where both inputs are within the threshold of each other, 0 elsewhere
+    threshold = 0.1
+    return np.where(np.abs(np.asarray(x) - np.asarray(y)) < threshold, 1, 0)
+
+
+def edge(x):
+    x = np.asarray(x)
+    with np.errstate(over='ignore', invalid='ignore'):
+        return np.where((x < 0) | (x > 10), 0, np.power(1 - x / 10, 5))
+
+
+def mean(x, y):
+    # (x + y) / 2 on arrays, x and y can be lists (in which case "+" would concatenate them)
+    return (np.asarray(x) + np.asarray(y)) / 2
+
+
+def protected_divide(x, y, safe=None):
+    # If y contains a zero, x is returned unchanged. The test is done on the last axis, so that a 2-D array
+    # (one row per node or individual) is protected row by row, exactly like a single 1-D array would be.
+    # When only a part of the values is given (e.g. a chunk of a long piece), safe must be given : it tells whether y
+    # contains no zero on the whole piece.
+    x, y = np.asarray(x), np.asarray(y)
+    if safe is None:
+        safe = np.all(y != 0, axis=-1, keepdims=True)
+    return np.where(safe, x / np.where(safe, y, 1), x)
+
+
+def protected_mod(x, y, safe=None):
+    x, y = np.asarray(x), np.asarray(y)
+    if safe is None:
+        safe = np.all(y != 0, axis=-1, keepdims=True)
+    return np.where(safe, x % np.where(safe, y, 1), x)
+
+
+# Every function works on whole arrays (1-D for a single node, 2-D when several nodes are stacked), there is no loop over
+# the timesteps.
+dict_functions = {"SUM": lambda x, y: np.asarray(x) + np.asarray(y),
+                  "DELTA": lambda x, y: delta(x, y),
+                  "EDGE": lambda x, y: edge(x),
+                  "MULT": lambda x, y: np.asarray(x) * np.asarray(y),
+                  "DIV": lambda x, y: protected_divide(x, y),
+                  "MOD": lambda x, y: protected_mod(x, y),
+                  "SIN": lambda x, y: np.sin(mean(x, y)),
+                  "COS": lambda x, y: np.cos(mean(x, y)),
+                  "UNARY_MIN": lambda x: -np.asarray(x),
+                  "UNARY_PLUS": lambda x: np.asarray(x) + 1,
+                  "LOG": lambda x, y: np.log(0.00001 + np.abs(mean(x, y))),
+                  "EXP": lambda x, y: np.exp(np.abs(mean(x, y)))}
+
+
+def midiMap(n):
+    # Maps a value n to a valid note.
+    octave = n / 7
+    chroma = n % 7
+    retval = octave * 12
+    if chroma == 0: return retval + 0
+    elif chroma == 1: return retval + 2
+    elif chroma == 2: return retval + 3
+    elif chroma == 3: return retval + 5
+    elif chroma == 4: return retval + 7
+    elif chroma == 5: return retval + 8
+    elif chroma == 6: return retval + 10
+
+
+# Notes given by midiMap for every value output can map (from 18 to 50, cf output)
+midi_table = np.array([int(midiMap(n)) for n in range(51)])
+
+
+def activity_levels(levels, threshold=1.5, activity=0.):
+    """
+    Leaky accumulator of output : the activity decays by a factor 4 at each step, and is reset (multiplied by 0.05)
+    each time it reaches threshold, i.e. each time a note is played.
+    The recurrence is done in the same order as in the original implementation, so the values are exactly the same
+    (a closed-form filter would round differently). When levels is 2-D, all the rows are computed at once.
+    :param levels: absolute value of the first input of output, 1-D or 2-D (one row per output)
+    :param activity: activity before the first step (one value per row if levels is 2-D)
+    :return: activity at each step (before the reset), and activity after the last step
+    """
+    if levels.ndim == 1:
+        retval = []
+        activity = float(activity)
+        for level in levels.tolist():
+            activity = activity * 0.25 + level
+            retval.append(activity)
+            if not activity < threshold:
+                activity *= 0.05
+        return np.array(retval, dtype=float), activity
+
+    retval = np.empty(levels.shape)
+    activity = np.zeros(len(levels)) + activity
+    for k in range(levels.shape[1]):
+        activity = activity * 0.25 + levels[:, k]
+        retval[:, k] = activity
+        activity = np.where(activity < threshold, activity, activity * 0.05)
+    return retval, activity
+
+
+def output(args):
+    """
+    The implementation is not ours, it is merely a copy of what was done in the original paper. Hence, some values are
+    chosen quite arbitrarily.
+    :param args: the two inputs of the output node, 1-D, or 2-D to compute several outputs at once
+    :return: note and velocity arrays, of the same shape as the inputs
+    """
+    note, velocity, state = output_chunk(args)
+    return note, velocity
+
+
+def output_chunk(args, state=(0., 0)):
+    """
+    Same as output, for a piece that is computed chunk by chunk : the state of output at the end of the previous
+    chunk is given, and the state at the end of this chunk is returned.
+    :param state: activity and last note played (one value per row if the inputs are 2-D). (0., 0) for the first chunk
+    :return: note and velocity arrays, of the same shape as the inputs, and the state for the next chunk
+    """
+    threshold = 1.5
+    activity, last_activity = activity_levels(np.abs(np.asarray(args[0], dtype=float)), threshold, state[0])
+    value = np.asarray(args[1], dtype=float)
+
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        # A note is played when activity reaches threshold (or is NaN)
+        played = ~(activity < threshold)
+        vel = np.where(played, 50.0 + 50.0 * np.log(1.0 + activity - threshold), 0)
+        # NaN or infinite velocities are set to 0
+        vel = np.where(np.isfinite(vel), np.minimum(vel, 127), 0).astype(int)
+        velocity = np.where(played, vel, np.where(activity < 0.05 * threshold, 0, -1))
+
+        # NaN values are replaced by 100
+        value = np.where(np.isnan(value), 100, value)
+        n = (18 + 32 * 0.5 * (1.0 + np.tanh(value))).astype(int)
+
+    # When no note is played, the last note is repeated (the one of the previous chunk before the first one)
+    steps = np.arange(1, activity.shape[-1] + 1)
+    last = np.maximum.accumulate(np.where(played, steps, 0), axis=-1)
+    previous = np.zeros(activity.shape[:-1] + (1,), dtype=int) + np.reshape(state[1], np.shape(state[1]) + (1,))
+    notes = np.concatenate((previous, midi_table[n]), axis=-1)
+    note = np.take_along_axis(notes, last, axis=-1)
+    last_note = note[..., -1] if note.shape[-1] > 0 else np.asarray(state[1])
+    return note, velocity, (last_activity, last_note)
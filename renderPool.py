@@ -0,0 +1,88 @@
+"""
+Parallel generation of the midi files : a pool of processes builds, runs, screens (cf musicGeneration.prescreen) and
+renders the individuals of a population from their arrays (a few integers each, instead of a pickled MusicGraph),
+and gives the midi files back in order. Each worker loads the schema itself : a schema file is memory-mapped (cf
+musicGeneration.load_xyz), so it is shared by the workers instead of being pickled to each of them.
+"""
+import multiprocessing
+import os
+import time
+
+import graphCompiler
+import musicGeneration
+
+# Inputs of the worker, set once when it starts
+_data = None
+_schema = None
+_min_variety = 0.
+
+
+def _init_worker(schema_file, min_variety):
+    global _data, _schema, _min_variety
+    _data = musicGeneration.load_schema(schema_file)
+    _schema = graphCompiler.cast_schema(_data)
+    _min_variety = min_variety
+
+
+def _render(genes):
+    # Runs in a worker : midi file of an array (None if it is rejected), reason of the rejection, pid of the worker and
+    # time spent
+    start = time.time()
+    results = graphCompiler.run_program(graphCompiler.simplify_program(graphCompiler.compile_genes(genes)), _schema)
+    reason = musicGeneration.prescreen([results], _min_variety)[0]
+    midi = None
+    if reason is None:
+        midi = musicGeneration.runFromData(data=_data, results=results, as_bytes=True)
+    return midi, reason, os.getpid(), time.time() - start
+
+
+class RenderPool:
+    """
+    Pool of processes that turn arrays into midi files (as bytes, cf musicGeneration.runFromData).
+
+    Params:
+        schema_file: schema loaded by the workers, a file or a spec (cf musicGeneration.load_schema),
+        musicGeneration.schema_file by default
+        processes: number of workers, the number of CPUs of the machine by default
+        chunksize: number of arrays sent to a worker at once. By default, each worker gets about 4 chunks per
+        population, which balances the work without sending too many small messages.
+        min_variety: cf musicGeneration.prescreen
+    """
+
+    def __init__(self, schema_file=None, processes=None, chunksize=None, min_variety=0.):
+        if schema_file is None:
+            schema_file = musicGeneration.schema_file
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self._pool = multiprocessing.Pool(self.processes, initializer=_init_worker,
+                                          initargs=(schema_file, min_variety))
+        self._work = {}  # pid of the worker: [number of individuals, time spent]
+
+    def render(self, population):
+        """
+        :param population: list of arrays
+        :return: list of tuples (midi file, reason) in the order of the arrays : reason is None if the array passed
+        the pre-screen, and the midi file is None if it did not
+        """
+        if len(population) == 0:
+            return []
+        chunksize = self.chunksize or max(1, len(population) // (4 * self.processes))
+        rendered = self._pool.map(_render, population, chunksize)
+        for _, _, pid, seconds in rendered:
+            work = self._work.setdefault(pid, [0, 0.])
+            work[0] += 1
+            work[1] += seconds
+        return [(midi, reason) for midi, reason, _, _ in rendered]
+
+    def reset_stats(self):
+        """ Resets the counters, typically at the start of each generation. """
+        self._work = {}
+
+    def stats(self):
+        """ Individuals rendered by each worker, and its throughput (individuals per second of work) """
+        return ", ".join("%s: %s (%.0f/s)" % (pid, n, n / seconds if seconds > 0 else 0.)
+                         for pid, (n, seconds) in sorted(self._work.items()))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
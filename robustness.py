@@ -0,0 +1,44 @@
+"""
+Checks whether a good array stays "good" with different inputs (cf ReadMe) : the array is run on every schema at once,
+then a midi file is generated for each schema and its fitness is calculated.
+"""
+import sys
+
+import joblib as jl
+
+import fitness as f
+import graphCompiler
+import jSymbolic
+import musicGeneration
+
+
+def evaluate_on_schemas(genes, schemas=None):
+    """
+    :param genes: array, cf ReadMe
+    :param schemas: dictionary name: schema, every schema written by generateXYZ.py by default
+    :return: dictionary name: (results, fitness), results being the notes and velocities of the outputs, and fitness
+    being None if the midi file is empty
+    """
+    if schemas is None:
+        schemas = musicGeneration.load_schemas()
+    names = list(schemas)
+    results = graphCompiler.run_schemas(graphCompiler.compile_genes(genes), [schemas[name] for name in names])
+
+    midis = {}
+    for k in range(len(names)):
+        midi = musicGeneration.runFromData(data=schemas[names[k]], results=results[k], as_bytes=True)
+        if midi is not None:
+            midis[k] = midi
+    features = jSymbolic.extract_features(midis) if len(midis) > 0 else {}
+    rendered = [k for k in midis if k in features]
+    fitnesses = [None] * len(names)
+    if len(rendered) > 0:
+        for k, fit_k in zip(rendered, f.fitness([features[k] for k in rendered])):
+            fitnesses[k] = fit_k
+    return {name: (results[k], fitnesses[k]) for k, name in enumerate(names)}
+
+
+if __name__ == "__main__":
+    # python robustness.py array.pkl : prints the fitness of a saved array on every schema
+    for name, (results, fit_k) in evaluate_on_schemas(jl.load(sys.argv[1])).items():
+        print(name, "empty" if fit_k is None else "%.3f" % fit_k)